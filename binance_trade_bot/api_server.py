@@ -1,7 +1,7 @@
 import re
 from datetime import datetime, timedelta
 from itertools import groupby
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 from flask import Flask, jsonify, request
 from flask_cors import CORS
@@ -10,9 +10,9 @@ from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from .config import Config
-from .database import Database
+from .database import VALUE_HISTORY_RETENTION, Database
 from .logger import Logger
-from .models import Coin, CoinValue, CurrentCoin, Pair, ScoutHistory, Trade
+from .models import Coin, CoinValue, CurrentCoin, Interval, Pair, PortfolioValue, ScoutHistory, Trade
 
 app = Flask(__name__)
 cors = CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -22,27 +22,37 @@ socketio = SocketIO(app, cors_allowed_origins="*")
 
 logger = Logger("api_server")
 config = Config()
-db = Database(logger, config)
+# The bot changes the coins and the current coin from its own process, so nothing can be cached here.
+# The API server only reads, through a read-only connection that never holds up the bot's writes.
+db = Database(logger, config, cache=False, read_only=True)
 
 
-def filter_period(query, model):  # pylint: disable=inconsistent-return-statements
+def get_period_start(now: datetime = None) -> Optional[datetime]:  # pylint: disable=inconsistent-return-statements
     period = request.args.get("period", "all")
 
     if period == "all":
-        return query
+        return None
 
     num = float(re.search(r"(\d*)[shdwm]", "1d").group(1))
+    now = now or datetime.now()
 
     if "s" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(seconds=num))
+        return now - timedelta(seconds=num)
     if "h" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(hours=num))
+        return now - timedelta(hours=num)
     if "d" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(days=num))
+        return now - timedelta(days=num)
     if "w" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(weeks=num))
+        return now - timedelta(weeks=num)
     if "m" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(days=28 * num))
+        return now - timedelta(days=28 * num)
+
+
+def filter_period(query, model, now: datetime = None):
+    start = get_period_start(now)
+    if start is None:
+        return query
+    return query.filter(model.datetime >= start)
 
 
 @app.route("/api/value_history/<coin>")
@@ -62,17 +72,38 @@ def value_history(coin: str = None):
         return jsonify({coin.symbol: [entry.info() for entry in history] for coin, history in coin_values})
 
 
+def get_total_value_intervals(session: Session, start: Optional[datetime], now: datetime) -> List[Interval]:
+    """
+    Get the intervals of the portfolio totals to read from `start` to `now`: the shortest interval that is still
+    kept for the whole period, and the longer ones
+    """
+    if start is None:
+        start = session.query(func.min(PortfolioValue.datetime)).scalar()
+    intervals = list(Interval)
+    for interval, retention in VALUE_HISTORY_RETENTION.items():
+        if start is None or start >= now - retention:
+            return intervals[intervals.index(interval) :]
+    return [Interval.WEEKLY]
+
+
 @app.route("/api/total_value_history")
 def total_value_history():
+    # The same time for the whole request, or a period as long as a retention time would fall just outside of it
+    now = datetime.now()
     session: Session
     with db.db_session() as session:
-        query = session.query(
-            CoinValue.datetime,
-            func.sum(CoinValue.btc_value),
-            func.sum(CoinValue.usd_value),
-        ).group_by(CoinValue.datetime)
+        intervals = get_total_value_intervals(session, get_period_start(now), now)
+        query = (
+            session.query(
+                PortfolioValue.datetime,
+                PortfolioValue.btc_value,
+                PortfolioValue.usd_value,
+            )
+            .filter(PortfolioValue.interval.in_(intervals))
+            .order_by(PortfolioValue.datetime.asc())
+        )
 
-        query = filter_period(query, CoinValue)
+        query = filter_period(query, PortfolioValue, now)
 
         total_values: List[Tuple[datetime, float, float]] = query.all()
         return jsonify([{"datetime": tv[0], "btc": tv[1], "usd": tv[2]} for tv in total_values])
@@ -93,20 +124,10 @@ def trade_history():
 @app.route("/api/scouting_history")
 def scouting_history():
     _current_coin = db.get_current_coin()
-    coin = _current_coin.symbol if _current_coin is not None else None
-    session: Session
-    with db.db_session() as session:
-        query = (
-            session.query(ScoutHistory)
-            .join(ScoutHistory.pair)
-            .filter(Pair.from_coin_id == coin)
-            .order_by(ScoutHistory.datetime.asc())
-        )
-
-        query = filter_period(query, ScoutHistory)
-
-        scouts: List[ScoutHistory] = query.all()
-        return jsonify([scout.info() for scout in scouts])
+    if _current_coin is None:
+        return jsonify([])
+    scouts: List[ScoutHistory] = db.get_scout_history(_current_coin, get_period_start())
+    return jsonify([scout.info() for scout in scouts])
 
 
 @app.route("/api/current_coin")
@@ -1,13 +1,93 @@
+import heapq
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional, Set, Tuple
 
-from sqlalchemy.orm import Session
+import numpy as np
 
 from .binance_api_manager import BinanceAPIManager
 from .config import Config
 from .database import Database
 from .logger import Logger
 from .models import Coin, CoinValue, Pair
+from .ratio_matrix import RatioMatrix
+
+# Number of partial paths kept at each step of the jump path search
+JUMP_PATH_BEAM_WIDTH = 64
+
+
+def get_jump_score(config: Config, coin_price, optional_coin_price, ratio, from_fee, to_fee):
+    """
+    Score of jumping from a coin to an optional coin, positive when the jump is worth it.
+    Works both on single prices and on numpy arrays of them.
+    """
+    # Obtain (current coin)/(optional coin)
+    coin_opt_coin_ratio = coin_price / optional_coin_price
+
+    transaction_fee = from_fee + to_fee - from_fee * to_fee
+
+    if config.USE_MARGIN == "yes":
+        return (1 - transaction_fee) * coin_opt_coin_ratio / ratio - 1 - config.SCOUT_MARGIN / 100
+    return (coin_opt_coin_ratio - transaction_fee * config.SCOUT_MULTIPLIER * coin_opt_coin_ratio) - ratio
+
+
+def get_jump_weight(config: Config, coin_price, optional_coin_price, ratio, from_fee, to_fee):
+    """
+    Log of the gain of jumping from a coin to an optional coin, positive exactly when the jump score is.
+    Unlike the scores, the weights of consecutive jumps add up, so a path of jumps is worth their sum.
+    Works both on single prices and on numpy arrays of them.
+    """
+    coin_opt_coin_ratio = coin_price / optional_coin_price
+
+    transaction_fee = from_fee + to_fee - from_fee * to_fee
+
+    if config.USE_MARGIN == "yes":
+        return np.log((1 - transaction_fee) * coin_opt_coin_ratio / ratio) - np.log(1 + config.SCOUT_MARGIN / 100)
+    return np.log((1 - transaction_fee * config.SCOUT_MULTIPLIER) * coin_opt_coin_ratio / ratio)
+
+
+class JumpScores:
+    """
+    The scores of jumping from one coin to the others, with a max-heap to find the best one without
+    going through all of them. Outdated heap entries are only dropped when they reach the top.
+    """
+
+    def __init__(self, state, cursor: int):
+        # What all the scores depend on, the scores are only valid as long as it stays the same
+        self.state = state
+        # Position in the stream of ticker changes the scores are up to date with
+        self.cursor = cursor
+        self.scores: Dict[str, Tuple[Pair, float]] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+
+    def set(self, pair: Pair, order: int, score: float):
+        """
+        Set the score of a pair. Between equal scores, the pair with the lowest `order` is the best.
+        """
+        self.scores[pair.to_coin_id] = (pair, score)
+        heapq.heappush(self._heap, (-score, order, pair.to_coin_id))
+        if len(self._heap) > 2 * len(self.scores) + 16:
+            self._heap = [entry for entry in self._heap if self._is_current(entry)]
+            heapq.heapify(self._heap)
+
+    def remove(self, pair: Pair):
+        self.scores.pop(pair.to_coin_id, None)
+
+    def _is_current(self, entry: Tuple[float, int, str]) -> bool:
+        score = self.scores.get(entry[2])
+        return score is not None and score[1] == -entry[0]
+
+    def best(self) -> Optional[Tuple[Pair, float]]:
+        """
+        Get the pair with the best score, and its score
+        """
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return self.scores[self._heap[0][2]]
+
+    def as_dict(self) -> Dict[Pair, float]:
+        return dict(self.scores.values())
 
 
 class AutoTrader:
@@ -22,8 +102,15 @@ class AutoTrader:
         self.db = database
         self.logger = logger
         self.config = config
+        self.ratios: Optional[RatioMatrix] = None
+        # Fee of each (coin symbol, selling) trade against the bridge, valid as long as the fee state doesn't change
+        self._fees: Dict[Tuple[str, bool], float] = {}
+        self._fee_state = None
+        # Scores of the jumps from each coin, kept up to date incrementally
+        self._scores: Dict[str, JumpScores] = {}
 
     def initialize(self):
+        self.ratios = RatioMatrix(self.db, self.logger)
         self.initialize_trade_thresholds()
 
     def transaction_through_bridge(self, pair: Pair):
@@ -46,6 +133,8 @@ class AutoTrader:
             return None
 
         result = self.manager.buy_alt(pair.to_coin, self.config.BRIDGE)
+        # Balances changed, and with them the amounts the BNB discount is checked against
+        self._clear_fees()
         if result is not None:
             self.db.set_current_coin(pair.to_coin)
             self.update_trade_threshold(pair.to_coin, result.price)
@@ -63,39 +152,38 @@ class AutoTrader:
             self.logger.info(f"Skipping update... current coin {coin + self.config.BRIDGE} not found")
             return
 
-        session: Session
-        with self.db.db_session() as session:
-            for pair in session.query(Pair).filter(Pair.to_coin == coin):
-                from_coin_price = self.manager.get_ticker_price(pair.from_coin + self.config.BRIDGE)
+        ratios = np.full(len(self.ratios.symbols), np.nan)
+        for pair in self.ratios.pairs_to(coin, only_enabled=False):
+            from_coin_price = self.manager.get_ticker_price(pair.from_coin + self.config.BRIDGE)
 
-                if from_coin_price is None:
-                    self.logger.info(f"Skipping update for coin {pair.from_coin + self.config.BRIDGE} not found")
-                    continue
+            if from_coin_price is None:
+                self.logger.info(f"Skipping update for coin {pair.from_coin + self.config.BRIDGE} not found")
+                continue
 
-                pair.ratio = from_coin_price / coin_price
+            ratios[self.ratios.index[pair.from_coin_id]] = from_coin_price / coin_price
+        self.ratios.set_column(coin, ratios)
 
     def initialize_trade_thresholds(self):
         """
         Initialize the buying threshold of all the coins for trading between them
         """
-        session: Session
-        with self.db.db_session() as session:
-            for pair in session.query(Pair).filter(Pair.ratio.is_(None)).all():
-                if not pair.from_coin.enabled or not pair.to_coin.enabled:
-                    continue
-                self.logger.info(f"Initializing {pair.from_coin} vs {pair.to_coin}")
-
-                from_coin_price = self.manager.get_ticker_price(pair.from_coin + self.config.BRIDGE)
-                if from_coin_price is None:
-                    self.logger.info(f"Skipping initializing {pair.from_coin + self.config.BRIDGE}, symbol not found")
-                    continue
-
-                to_coin_price = self.manager.get_ticker_price(pair.to_coin + self.config.BRIDGE)
-                if to_coin_price is None:
-                    self.logger.info(f"Skipping initializing {pair.to_coin + self.config.BRIDGE}, symbol not found")
-                    continue
+        uninitialized = self.ratios.has_pair & np.isnan(self.ratios.ratios)
+        # Only the prices of the coins that are part of a pair to initialize are needed
+        needed = self.ratios.enabled & (uninitialized.any(axis=0) | uninitialized.any(axis=1))
+
+        prices = np.full(len(self.ratios.symbols), np.nan)
+        for i in np.flatnonzero(needed):
+            symbol = self.ratios.symbols[i] + self.config.BRIDGE.symbol
+            price = self.manager.get_ticker_price(symbol)
+            if price is None:
+                self.logger.info(f"Skipping initializing {symbol}, symbol not found")
+                continue
+            prices[i] = price
 
-                pair.ratio = from_coin_price / to_coin_price
+        for from_symbol, to_symbol in self.ratios.initialize(prices):
+            self.logger.info(f"Initialized [{from_symbol}] vs [{to_symbol}]")
+        # Thresholds are written right away at startup, so that they aren't lost if the bot stops early
+        self.ratios.flush()
 
     def scout(self):
         """
@@ -103,72 +191,253 @@ class AutoTrader:
         """
         raise NotImplementedError()
 
-    def _get_ratios(self, coin: Coin, coin_price):
+    def scout_changes(self, ticker_symbols: Set[str]):
         """
-        Given a coin, get the current price ratio for every other enabled coin
+        Scout after the prices of the given ticker symbols changed. Strategies that can limit the scout
+        to the coins that changed should override this, by default it's a full scout.
+        """
+        self.scout()
+
+    def _refresh_fees(self):
+        """
+        Forget the fees computed so far if the BNB balance or the BNB burn setting changed since
+        """
+        state = self.manager.get_fee_state()
+        if state != self._fee_state:
+            self._clear_fees()
+            self._fee_state = state
+
+    def _clear_fees(self):
+        self._fees.clear()
+        # The scores were computed with the old fees
+        self._scores.clear()
+
+    def _get_fee(self, coin: Coin, selling: bool) -> float:
+        """
+        Get the fee of trading a coin against the bridge, from the fee table
         """
-        ratio_dict: Dict[Pair, float] = {}
+        key = (coin.symbol, selling)
+        fee = self._fees.get(key)
+        if fee is None:
+            fee = self._fees[key] = self.manager.get_fee(coin, self.config.BRIDGE, selling)
+        return fee
 
-        for pair in self.db.get_pairs_from(coin):
+    def _score_jumps(self, coin: Coin, coin_price: float, to_symbols: Set[str] = None) -> "JumpScores":
+        """
+        Given a coin, bring the scores of jumping to every other enabled coin up to date.
+
+        Scores are kept between scouts, and only the ones of the coins whose price changed since are computed
+        again, unless something all the scores depend on changed: the price of the coin itself, the thresholds
+        or the fees. The given coins are scored again in any case.
+        """
+        self._refresh_fees()
+        state = (coin_price, self.ratios.version)
+        scores = self._scores.get(coin.symbol)
+        changed, cursor = self.manager.get_ticker_changes(scores.cursor if scores is not None else None)
+
+        bridge = self.config.BRIDGE.symbol
+        if scores is None or scores.state != state or changed is None:
+            scores = self._scores[coin.symbol] = JumpScores(state, cursor)
+            pairs = self.ratios.pairs_from(coin)
+        else:
+            scores.cursor = cursor
+            symbols = {symbol[: -len(bridge)] for symbol in changed if symbol.endswith(bridge)}
+            symbols.update(to_symbols or ())
+            pairs = [
+                pair for pair in (self.ratios.get_pair(coin, symbol) for symbol in sorted(symbols)) if pair is not None
+            ]
+
+        from_fee = None
+        for pair in pairs:
             optional_coin_price = self.manager.get_ticker_price(pair.to_coin + self.config.BRIDGE)
 
             if optional_coin_price is None:
                 self.logger.info(f"Skipping scouting... optional coin {pair.to_coin + self.config.BRIDGE} not found")
+                scores.remove(pair)
                 continue
 
-            self.db.log_scout(pair, pair.ratio, coin_price, optional_coin_price)
-
-            # Obtain (current coin)/(optional coin)
-            coin_opt_coin_ratio = coin_price / optional_coin_price
+            ratio = self.ratios.get_ratio(pair)
+            self.db.log_scout(pair, ratio, coin_price, optional_coin_price)
 
             # Fees
-            from_fee = self.manager.get_fee(pair.from_coin, self.config.BRIDGE, True)
-            to_fee = self.manager.get_fee(pair.to_coin, self.config.BRIDGE, False)
-            transaction_fee = from_fee + to_fee - from_fee * to_fee
+            if from_fee is None:
+                from_fee = self._get_fee(pair.from_coin, True)
+            to_fee = self._get_fee(pair.to_coin, False)
 
-            if self.config.USE_MARGIN == "yes":
-                ratio_dict[pair] = (
-                    (1 - transaction_fee) * coin_opt_coin_ratio / pair.ratio - 1 - self.config.SCOUT_MARGIN / 100
-                )
-            else:
-                ratio_dict[pair] = (
-                    coin_opt_coin_ratio - transaction_fee * self.config.SCOUT_MULTIPLIER * coin_opt_coin_ratio
-                ) - pair.ratio
-        return ratio_dict
+            score = get_jump_score(self.config, coin_price, optional_coin_price, ratio, from_fee, to_fee)
+            scores.set(pair, self.ratios.index[pair.to_coin_id], score)
+        return scores
 
-    def _jump_to_best_coin(self, coin: Coin, coin_price: float):
+    def _get_ratios(self, coin: Coin, coin_price, to_symbols: Set[str] = None) -> Dict[Pair, float]:
         """
-        Given a coin, search for a coin to jump to
+        Given a coin, get the current price ratio for every other enabled coin
         """
-        ratio_dict = self._get_ratios(coin, coin_price)
+        return self._score_jumps(coin, coin_price, to_symbols).as_dict()
 
-        # keep only ratios bigger than zero
-        ratio_dict = {k: v for k, v in ratio_dict.items() if v > 0}
+    def _jump_to_best_coin(self, coin: Coin, coin_price: float, to_symbols: Set[str] = None):
+        """
+        Given a coin, search for a coin to jump to. The given coins are scored again even if their price
+        didn't change.
+        """
+        best = self._score_jumps(coin, coin_price, to_symbols).best()
+
+        if self.config.MAX_JUMP_HOPS > 1:
+            path = self._find_jump_path(coin, self._get_prices())
+            if path is not None:
+                self.logger.info(
+                    f"Will be jumping from {coin} to {path[-1].to_coin_id} through "
+                    f"{', '.join(pair.to_coin_id for pair in path[:-1])}"
+                )
+                for pair in path:
+                    if self.transaction_through_bridge(pair) is None:
+                        break
+                return
 
         # if we have any viable options, pick the one with the biggest ratio
-        if ratio_dict:
-            best_pair = max(ratio_dict, key=ratio_dict.get)
+        if best is not None and best[1] > 0:
+            best_pair = best[0]
             self.logger.info(f"Will be jumping from {coin} to {best_pair.to_coin_id}")
             self.transaction_through_bridge(best_pair)
 
+    def _get_prices(self) -> np.ndarray:
+        """
+        Get the bridge price of every coin, in the order of the ratio matrix. NaN for the disabled coins and the
+        prices that aren't known.
+        """
+        prices = np.full(len(self.ratios.symbols), np.nan)
+        for i in np.flatnonzero(self.ratios.enabled):
+            price = self.manager.get_ticker_price(self.ratios.symbols[i] + self.config.BRIDGE.symbol)
+            if price is not None:
+                prices[i] = price
+        return prices
+
+    def _get_fees(self, indexes: np.ndarray, selling: bool) -> np.ndarray:
+        """
+        Get the fees of trading the given coins against the bridge, in the order of the ratio matrix
+        """
+        fees = np.full(len(self.ratios.symbols), np.nan)
+        for i in indexes:
+            fees[i] = self._get_fee(self.db.get_coin(self.ratios.symbols[i]), selling)
+        return fees
+
+    def _score_all_jumps(self, from_indexes: np.ndarray, prices: np.ndarray) -> np.ndarray:
+        """
+        Score the jumps from each of the given coins to every other coin at once
+
+        :param from_indexes: The coins to jump from, as indexes in the ratio matrix
+        :param prices: The prices from _get_prices()
+        :return: A (from coins x coins) array of scores. -inf where there is no jump to score, NaN where the
+            threshold of the jump isn't initialized.
+        """
+        self._refresh_fees()
+        known = np.flatnonzero(~np.isnan(prices))
+        from_fees = self._get_fees(from_indexes, True)[from_indexes]
+        to_fees = self._get_fees(known, False)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores = get_jump_score(
+                self.config,
+                prices[from_indexes, None],
+                prices[None, :],
+                self.ratios.ratios[from_indexes],
+                from_fees[:, None],
+                to_fees[None, :],
+            )
+        scores[~(self.ratios.has_pair[from_indexes] & ~np.isnan(prices)[None, :])] = -np.inf
+        return scores
+
+    def _best_jump(self, from_index: int, scores: np.ndarray) -> Optional[Tuple[Pair, float]]:
+        """
+        Get the pair with the best score in a row of _score_all_jumps(), and its score
+        """
+        missing = np.flatnonzero(np.isnan(scores))
+        if len(missing) > 0:
+            raise ValueError(
+                f"Threshold from {self.ratios.symbols[from_index]} to {self.ratios.symbols[missing[0]]} "
+                "isn't initialized"
+            )
+        to_index = int(np.argmax(scores))
+        if scores[to_index] == -np.inf:
+            return None
+        return self.ratios.pairs[(from_index, to_index)], float(scores[to_index])
+
+    def _log_scouts(self, from_index: int, prices: np.ndarray):
+        """
+        Log the scouts from a coin to every other coin that has a price
+        """
+        for to_index in np.flatnonzero(self.ratios.has_pair[from_index] & ~np.isnan(prices)):
+            pair = self.ratios.pairs[(from_index, int(to_index))]
+            self.db.log_scout(pair, self.ratios.get_ratio(pair), float(prices[from_index]), float(prices[to_index]))
+
+    def _find_jump_path(self, coin: Coin, prices: np.ndarray) -> Optional[List[Pair]]:
+        """
+        Search for the best path of up to MAX_JUMP_HOPS jumps from a coin, with a beam search over the jump weights
+        between all the coins. A path never goes through the same coin twice.
+
+        :param prices: The prices from _get_prices()
+        :return: The pairs to jump along, if the best path is worth it and has more than one jump. Otherwise the
+            direct jumps are as good as it gets.
+        """
+        self._refresh_fees()
+        known = np.flatnonzero(~np.isnan(prices))
+        from_fees = self._get_fees(known, True)
+        to_fees = self._get_fees(known, False)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weights = get_jump_weight(
+                self.config, prices[:, None], prices[None, :], self.ratios.ratios, from_fees[:, None], to_fees[None, :]
+            )
+        weights[~self.ratios.has_pair | np.isnan(weights)] = -np.inf
+
+        start = self.ratios.index[coin.symbol]
+        size = len(self.ratios.symbols)
+        # The partial paths, with the coin each one ends at, its total weight and the coins it went through
+        paths = [[start]]
+        ends = np.array([start])
+        totals = np.zeros(1)
+        visited = np.zeros((1, size), dtype=bool)
+        visited[0, start] = True
+
+        best_path, best_total = None, 0.0
+        for _ in range(self.config.MAX_JUMP_HOPS):
+            candidates = totals[:, None] + weights[ends]
+            candidates[visited] = -np.inf
+            kept = np.flatnonzero(candidates > -np.inf)
+            if len(kept) == 0:
+                break
+            if len(kept) > JUMP_PATH_BEAM_WIDTH:
+                kept = kept[np.argpartition(candidates.flat[kept], -JUMP_PATH_BEAM_WIDTH)[-JUMP_PATH_BEAM_WIDTH:]]
+            rows, ends = np.divmod(kept, size)
+            totals = candidates.flat[kept]
+            paths = [paths[row] + [end] for row, end in zip(rows, ends)]
+            visited = visited[rows]
+            visited[np.arange(len(rows)), ends] = True
+
+            i = int(np.argmax(totals))
+            if totals[i] > best_total:
+                best_path, best_total = paths[i], totals[i]
+
+        if best_path is None or len(best_path) <= 2:
+            return None
+        return [self.ratios.pairs[(int(a), int(b))] for a, b in zip(best_path, best_path[1:])]
+
     def bridge_scout(self):
         """
         If we have any bridge coin leftover, buy a coin with it that we won't immediately trade out of
         """
         bridge_balance = self.manager.get_currency_balance(self.config.BRIDGE.symbol)
 
-        for coin in self.db.get_coins():
-            current_coin_price = self.manager.get_ticker_price(coin + self.config.BRIDGE)
-
-            if current_coin_price is None:
-                continue
-
-            ratio_dict = self._get_ratios(coin, current_coin_price)
-            if not any(v > 0 for v in ratio_dict.values()):
+        prices = self._get_prices()
+        from_indexes = np.flatnonzero(~np.isnan(prices))
+        scores = self._score_all_jumps(from_indexes, prices)
+        for row, i in enumerate(from_indexes):
+            best = self._best_jump(i, scores[row])
+            if best is None or best[1] <= 0:
                 # There will only be one coin where all the ratios are negative. When we find it, buy it if we can
+                coin = self.db.get_coin(self.ratios.symbols[i])
                 if bridge_balance > self.manager.get_min_notional(coin.symbol, self.config.BRIDGE.symbol):
                     self.logger.info(f"Will be purchasing {coin} using bridge coin")
                     self.manager.buy_alt(coin, self.config.BRIDGE)
+                    self._clear_fees()
                     return coin
         return None
 
@@ -178,15 +447,12 @@ class AutoTrader:
         """
         now = datetime.now()
 
-        session: Session
-        with self.db.db_session() as session:
-            coins: List[Coin] = session.query(Coin).all()
-            for coin in coins:
-                balance = self.manager.get_currency_balance(coin.symbol)
-                if balance == 0:
-                    continue
-                usd_value = self.manager.get_ticker_price(coin + "USDT")
-                btc_value = self.manager.get_ticker_price(coin + "BTC")
-                cv = CoinValue(coin, balance, usd_value, btc_value, datetime=now)
-                session.add(cv)
-                self.db.send_update(cv)
+        values: List[CoinValue] = []
+        for coin in self.db.get_coins(only_enabled=False):
+            balance = self.manager.get_currency_balance(coin.symbol)
+            if balance == 0:
+                continue
+            usd_value = self.manager.get_ticker_price(coin + "USDT")
+            btc_value = self.manager.get_ticker_price(coin + "BTC")
+            values.append(CoinValue(coin, balance, usd_value, btc_value, datetime=now))
+        self.db.log_values(values)
@@ -1,73 +1,272 @@
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
+from itertools import islice
 from traceback import format_exc
-from typing import Dict
+from typing import Dict, List, Optional, Tuple, Union
 
-from sqlitedict import SqliteDict
+from binance.client import Client
+from binance.exceptions import BinanceAPIException
 
 from .binance_api_manager import BinanceAPIManager
-from .binance_stream_manager import BinanceOrder
+from .binance_stream_manager import BinanceCache, BinanceOrder
 from .config import Config
 from .database import Database
+from .exchange_snapshot import ExchangeSnapshot
 from .logger import Logger
-from .models import Coin, Pair
+from .models import Coin, CoinValue, CurrentCoin, Pair, Trade, TradeState
+from .price_store import RESOLUTIONS, PriceStore, to_minute
 from .strategies import get_strategy
+from .vectorized_backtest import VectorizedBacktest
 
-cache = SqliteDict("data/backtest_cache.db")
+cache = PriceStore()
+
+# Maximum number of klines returned by a single request
+KLINES_LIMIT = 1000
+
+
+class RateLimiter:  # pylint: disable=too-few-public-methods
+    """
+    Spaces out calls across threads so that no more than `per_minute` of them start each minute
+    """
+
+    def __init__(self, per_minute: int):
+        self.interval = 60 / per_minute
+        self.next_call = time.monotonic()
+        self.mutex = threading.Lock()
+
+    def wait(self):
+        with self.mutex:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def prefetch_prices(  # pylint: disable=too-many-arguments
+    binance_client: Client,
+    store: PriceStore,
+    logger: Logger,
+    symbols: List[str],
+    start: int,
+    end: int,
+    max_workers=4,
+    requests_per_minute=600,
+):
+    """
+    Download every price of the given symbols between the start and end minutes that isn't stored yet
+    """
+    end = min(end, to_minute(datetime.utcnow()))
+    windows = [
+        (symbol, window_start, min(window_start + KLINES_LIMIT, missing_end))
+        for symbol in symbols
+        for missing_start, missing_end in store.missing_ranges(symbol, start, end)
+        for window_start in range(missing_start, missing_end, KLINES_LIMIT)
+    ]
+    if not windows:
+        return
+    logger.info(f"Prefetching {len(windows)} price windows for {len(symbols)} symbols")
+
+    limiter = RateLimiter(requests_per_minute)
+    invalid_symbols = set()
+    windows = iter(windows)
+    with ThreadPoolExecutor(max_workers) as executor:
+        pending = set()
+        while True:
+            # Only keep a few windows in flight so that downloaded klines don't pile up in memory
+            for window in islice(windows, max_workers * 4 - len(pending)):
+                pending.add(executor.submit(_fetch_klines, binance_client, logger, limiter, invalid_symbols, *window))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                symbol, start, end, klines = future.result()
+                if klines is not None:
+                    store.write_klines(symbol, klines)
+                    # Minutes without a kline are recorded too, so that gaps aren't fetched again
+                    store.add_coverage(symbol, start, end)
+    store.flush()
+    logger.info("Prefetching done")
+
+
+def _fetch_klines(  # pylint: disable=too-many-arguments
+    binance_client: Client,
+    logger: Logger,
+    limiter: RateLimiter,
+    invalid_symbols: set,
+    symbol: str,
+    start: int,
+    end: int,
+):
+    """
+    Download the klines of a symbol for the minutes [start, end)
+
+    :return: The symbol, start, end and (open time, price) tuples, which are None if the download failed
+    """
+    while symbol not in invalid_symbols:
+        limiter.wait()
+        try:
+            klines = binance_client.get_klines(
+                symbol=symbol,
+                interval="1m",
+                startTime=start * 60000,
+                endTime=(end - 1) * 60000,
+                limit=KLINES_LIMIT,
+            )
+            return symbol, start, end, [(kline[0], float(kline[1])) for kline in klines]
+        except BinanceAPIException as e:
+            if e.status_code in (418, 429):
+                logger.warning(f"Rate limited while prefetching {symbol}, backing off")
+                time.sleep(int(e.response.headers.get("Retry-After", 60)))
+                continue
+            if e.code == -1121:
+                logger.info(f"Symbol {symbol} does not exist, it will not be prefetched")
+                invalid_symbols.add(symbol)
+                return symbol, start, end, []
+            logger.warning(f"Couldn't prefetch {symbol}, it will be fetched during the backtest: {e}")
+            return symbol, start, end, None
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"Couldn't prefetch {symbol}, it will be fetched during the backtest: {e}")
+            return symbol, start, end, None
+    # Another window found out that the symbol doesn't exist
+    return symbol, start, end, []
 
 
 class MockBinanceManager(BinanceAPIManager):
-    def __init__(
+    def __init__(  # pylint: disable=super-init-not-called,too-many-arguments
         self,
         config: Config,
         db: Database,
         logger: Logger,
         start_date: datetime = None,
         start_balances: Dict[str, float] = None,
+        store: PriceStore = None,
+        snapshot: ExchangeSnapshot = None,
+        fill_gaps: bool = False,
+        resolution: int = 1,
     ):
-        super().__init__(config, db, logger)
+        # The API client is only created if prices or symbol information have to be downloaded,
+        # and never when running from an exchange snapshot
+        self._binance_client: Optional[Client] = None
+        self.db = db
+        self.logger = logger
         self.config = config
+        self.cache = BinanceCache()
+        self.stream_manager = None
+        self.snapshot = snapshot
+        self.store = store or cache
+        self.fill_gaps = fill_gaps
+        self.resolution = resolution
         self.datetime = start_date or datetime(2021, 1, 1)
+        self.minute = to_minute(self.datetime)
         self.balances = start_balances or {config.BRIDGE.symbol: 100}
+        self.trade_count = 0
+
+    @property
+    def offline(self) -> bool:
+        return self.snapshot is not None
+
+    @property
+    def binance_client(self) -> Client:
+        if self.offline:
+            raise RuntimeError("Backtests running from an exchange snapshot can't call the Binance API")
+        if self._binance_client is None:
+            self._binance_client = Client(
+                self.config.BINANCE_API_KEY,
+                self.config.BINANCE_API_SECRET_KEY,
+                tld=self.config.BINANCE_TLD,
+            )
+        return self._binance_client
 
     def setup_websockets(self):
         pass  # No websockets are needed for backtesting
 
     def increment(self, interval=1):
         self.datetime += timedelta(minutes=interval)
+        self.minute += interval
 
     def get_fee(self, origin_coin: Coin, target_coin: Coin, selling: bool):
+        if self.offline:
+            fee = self.snapshot.get_trade_fee(origin_coin.symbol + target_coin.symbol)
+            if fee is not None:
+                return fee
         return 0.00075
 
+    def get_fee_state(self):
+        return None  # Backtest fees are fixed
+
+    def get_ticker_changes(self, cursor: Optional[int]):
+        return None, self.minute  # Any price may change from one minute to the next
+
+    def get_symbol_filter(self, origin_symbol: str, target_symbol: str, filter_type: str):
+        if not self.offline:
+            return super().get_symbol_filter(origin_symbol, target_symbol, filter_type)
+        return next(
+            _filter
+            for _filter in self.snapshot.get_symbol_info(origin_symbol + target_symbol)["filters"]
+            if _filter["filterType"] == filter_type
+        )
+
     def get_ticker_price(self, ticker_symbol: str):
         """
         Get ticker price of a specific coin
         """
-        target_date = self.datetime.strftime("%d %b %Y %H:%M:%S")
-        key = f"{ticker_symbol} - {target_date}"
-        val = cache.get(key, None)
-        if val is None:
-            end_date = self.datetime + timedelta(minutes=1000)
-            if end_date > datetime.now():
-                end_date = datetime.now()
-            end_date = end_date.strftime("%d %b %Y %H:%M:%S")
+        val = self.store.get_price(ticker_symbol, self.minute, resolution=self.resolution)
+        if (
+            val is None
+            and not self.offline
+            and not self.store.read_only
+            and not self.store.is_covered(ticker_symbol, self.minute)
+        ):
+            end_date = min(self.datetime + timedelta(minutes=1000), datetime.utcnow())
             self.logger.info(f"Fetching prices for {ticker_symbol} between {self.datetime} and {end_date}")
-            for result in self.binance_client.get_historical_klines(
-                ticker_symbol, "1m", target_date, end_date, limit=1000
-            ):
-                date = datetime.utcfromtimestamp(result[0] / 1000).strftime("%d %b %Y %H:%M:%S")
-                price = float(result[1])
-                cache[f"{ticker_symbol} - {date}"] = price
-            cache.commit()
-            val = cache.get(key, None)
+            try:
+                klines = self.binance_client.get_historical_klines(
+                    ticker_symbol,
+                    "1m",
+                    self.datetime.strftime("%d %b %Y %H:%M:%S"),
+                    end_date.strftime("%d %b %Y %H:%M:%S"),
+                    limit=1000,
+                )
+            except BinanceAPIException as e:
+                if e.code != -1121:
+                    raise
+                self.logger.info(f"Symbol {ticker_symbol} does not exist")
+                klines = []
+            self.store.write_klines(ticker_symbol, [(result[0], float(result[1])) for result in klines])
+            # The whole window is recorded as fetched, so that the minutes without a kline aren't fetched again
+            self.store.add_coverage(ticker_symbol, self.minute, max(self.minute + 1, to_minute(end_date)))
+            self.store.flush()
+            val = self.store.get_price(ticker_symbol, self.minute, resolution=self.resolution)
+        if val is None and self.fill_gaps:
+            val = self.store.get_price(ticker_symbol, self.minute, fill=True, resolution=self.resolution)
         return val
 
+    def prefetch(self, symbols: List[str], end_date: datetime):
+        """
+        Download every price of the given symbols between the current date and end_date that isn't cached yet
+        """
+        if self.offline:
+            missing = sum(
+                len(self.store.missing_ranges(symbol, self.minute, to_minute(end_date))) > 0 for symbol in symbols
+            )
+            if missing:
+                self.logger.warning(f"Prices of {missing} symbols are incomplete and can't be downloaded offline")
+            return
+        prefetch_prices(self.binance_client, self.store, self.logger, symbols, self.minute, to_minute(end_date))
+
     def get_currency_balance(self, currency_symbol: str, force=False):
         """
         Get balance of a specific coin
         """
         return self.balances.get(currency_symbol, 0)
 
+    def get_currency_balances(self, currency_symbols: List[str]) -> Dict[str, float]:
+        return {symbol: self.balances.get(symbol, 0) for symbol in currency_symbols}
+
     def buy_alt(self, origin_coin: Coin, target_coin: Coin):
         origin_symbol = origin_coin.symbol
         target_symbol = target_coin.symbol
@@ -78,6 +277,7 @@ class MockBinanceManager(BinanceAPIManager):
         order_quantity = self._buy_quantity(origin_symbol, target_symbol, target_balance, from_coin_price)
         target_quantity = order_quantity * from_coin_price
         self.balances[target_symbol] -= target_quantity
+        self.trade_count += 1
         self.balances[origin_symbol] = self.balances.get(origin_symbol, 0) + order_quantity * (
             1 - self.get_fee(origin_coin, target_coin, False)
         )
@@ -107,6 +307,7 @@ class MockBinanceManager(BinanceAPIManager):
             1 - self.get_fee(origin_coin, target_coin, True)
         )
         self.balances[origin_symbol] -= order_quantity
+        self.trade_count += 1
         self.logger.info(
             f"Sold {origin_symbol}, balance now: {self.balances[origin_symbol]} - bridge: "
             f"{self.balances[target_symbol]}"
@@ -132,9 +333,97 @@ class MockBinanceManager(BinanceAPIManager):
         return total
 
 
-class MockDatabase(Database):
+class MockTradeLog:
+    def __init__(self, trades: List[Trade], from_coin: Coin, to_coin: Coin, selling: bool):
+        self.trade = Trade(from_coin, to_coin, selling)
+        self.trade.id = len(trades) + 1
+        trades.append(self.trade)
+
+    def set_ordered(self, alt_starting_balance, crypto_starting_balance, alt_trade_amount):
+        self.trade.alt_starting_balance = alt_starting_balance
+        self.trade.alt_trade_amount = alt_trade_amount
+        self.trade.crypto_starting_balance = crypto_starting_balance
+        self.trade.state = TradeState.ORDERED
+
+    def set_complete(self, crypto_trade_amount):
+        self.trade.crypto_trade_amount = crypto_trade_amount
+        self.trade.state = TradeState.COMPLETE
+
+
+class MockDatabase:
+    """
+    Keeps the backtest state in plain dictionaries and lists instead of SQLite, with the same interface
+    as the parts of Database used by the trader. Nothing is persisted or sent to the API server.
+    """
+
     def __init__(self, logger: Logger, config: Config):
-        super().__init__(logger, config, "sqlite:///")
+        self.logger = logger
+        self.config = config
+        self.coins: Dict[str, Coin] = {}
+        self.pairs: Dict[Tuple[str, str], Pair] = {}
+        self.pairs_from: Dict[str, List[Pair]] = defaultdict(list)
+        self.pairs_to: Dict[str, List[Pair]] = defaultdict(list)
+        self.current_coin_history: List[CurrentCoin] = []
+        self.trades: List[Trade] = []
+
+    def create_database(self):
+        pass
+
+    def set_coins(self, symbols: List[str]):
+        for coin in self.coins.values():
+            coin.enabled = coin.symbol in symbols
+        for symbol in symbols:
+            if symbol not in self.coins:
+                self.coins[symbol] = Coin(symbol)
+
+        enabled_coins = [coin for coin in self.coins.values() if coin.enabled]
+        for from_coin in enabled_coins:
+            for to_coin in enabled_coins:
+                if from_coin is not to_coin and (from_coin.symbol, to_coin.symbol) not in self.pairs:
+                    pair = Pair(from_coin, to_coin)
+                    pair.id = len(self.pairs) + 1
+                    pair.from_coin_id = from_coin.symbol
+                    pair.to_coin_id = to_coin.symbol
+                    self.pairs[(from_coin.symbol, to_coin.symbol)] = pair
+                    self.pairs_from[from_coin.symbol].append(pair)
+                    self.pairs_to[to_coin.symbol].append(pair)
+
+    def get_coins(self, only_enabled=True) -> List[Coin]:
+        return [coin for coin in self.coins.values() if coin.enabled or not only_enabled]
+
+    def get_coin(self, coin: Union[Coin, str]) -> Coin:
+        if isinstance(coin, Coin):
+            return coin
+        return self.coins.get(coin)
+
+    def set_current_coin(self, coin: Union[Coin, str]):
+        self.current_coin_history.append(CurrentCoin(self.get_coin(coin)))
+
+    def get_current_coin(self) -> Optional[Coin]:
+        if not self.current_coin_history:
+            return None
+        return self.current_coin_history[-1].coin
+
+    def get_pair(self, from_coin: Union[Coin, str], to_coin: Union[Coin, str]) -> Pair:
+        return self.pairs.get((self.get_coin(from_coin).symbol, self.get_coin(to_coin).symbol))
+
+    def get_pairs_from(self, from_coin: Union[Coin, str], only_enabled=True) -> List[Pair]:
+        pairs = self.pairs_from[self.get_coin(from_coin).symbol]
+        return [pair for pair in pairs if not only_enabled or (pair.from_coin.enabled and pair.to_coin.enabled)]
+
+    def get_pairs_to(self, to_coin: Union[Coin, str], only_enabled=True) -> List[Pair]:
+        pairs = self.pairs_to[self.get_coin(to_coin).symbol]
+        return [pair for pair in pairs if not only_enabled or (pair.from_coin.enabled and pair.to_coin.enabled)]
+
+    def get_pairs(self, only_enabled=True) -> List[Pair]:
+        return [
+            pair
+            for pair in self.pairs.values()
+            if not only_enabled or (pair.from_coin.enabled and pair.to_coin.enabled)
+        ]
+
+    def update_pair_ratios(self, pairs: List[Pair]):
+        pass  # The pairs handed out are the stored ones, so their ratios are already up to date
 
     def log_scout(
         self,
@@ -145,6 +434,39 @@ class MockDatabase(Database):
     ):
         pass
 
+    def log_values(self, values: List[CoinValue]):
+        pass
+
+    def prune_scout_history(self):
+        pass
+
+    def prune_value_history(self):
+        pass
+
+    def start_trade_log(self, from_coin: Coin, to_coin: Coin, selling: bool):
+        return MockTradeLog(self.trades, from_coin, to_coin, selling)
+
+    def send_update(self, model):
+        pass
+
+    def send_updates(self, models):
+        pass
+
+
+def get_backtest_symbols(config: Config, balances: Dict[str, float]) -> List[str]:
+    """
+    Get every ticker symbol a backtest can look up: each coin against the bridge (for trading),
+    and against BTC and USDT (for valuing the balances)
+    """
+    symbols = {"BTC" + config.BRIDGE.symbol}
+    for coin in set(config.SUPPORTED_COIN_LIST) | set(balances):
+        if coin == config.BRIDGE.symbol:
+            continue
+        for quote in (config.BRIDGE.symbol, "BTC", "USDT"):
+            if coin != quote:
+                symbols.add(coin + quote)
+    return sorted(symbols)
+
 
 def backtest(
     start_date: datetime = None,
@@ -154,16 +476,35 @@ def backtest(
     start_balances: Dict[str, float] = None,
     starting_coin: str = None,
     config: Config = None,
+    prefetch: bool = True,
+    vectorized: bool = False,
+    store: PriceStore = None,
+    skip_idle: bool = False,
+    snapshot: ExchangeSnapshot = None,
+    fill_gaps: bool = False,
+    resolution: str = "1m",
 ):
     """
 
     :param config: Configuration object to use
     :param start_date: Date to  backtest from
     :param end_date: Date to backtest up to
-    :param interval: Number of virtual minutes between each scout
+    :param interval: Number of candles of the given resolution between each scout
     :param yield_interval: After how many intervals should the manager be yielded
     :param start_balances: A dictionary of initial coin values. Default: {BRIDGE: 100}
     :param starting_coin: The coin to start on. Default: first coin in coin list
+    :param prefetch: Download all the needed prices before starting, instead of fetching them as they are needed
+    :param vectorized: Scout with numpy over blocks of prices instead of calling the strategy every step.
+        Only available for the default strategy, and always prefetches prices
+    :param store: Price store to read prices from. Default: the shared backtest cache
+    :param skip_idle: Skip straight past the steps where no jump can happen instead of scouting each of them.
+        Only available for the default strategy, and always prefetches prices
+    :param snapshot: Exchange information and trade fees to use instead of calling the Binance API.
+        No request is made at all, so every price needed has to be in the store already
+    :param fill_gaps: Use the last known price of a symbol for the minutes it has no price for, e.g. during
+        maintenance or after it was delisted, instead of treating it as unavailable
+    :param resolution: Candle size to backtest with, one of 1m, 5m, 15m, 1h or 1d. Coarser candles make quick,
+        rough backtests: each scout uses the opening prices of the current candle
 
     :return: The final coin balances
     """
@@ -171,11 +512,30 @@ def backtest(
     logger = Logger("backtesting", enable_notifications=False)
 
     end_date = end_date or datetime.today()
+    store = store or cache
 
     db = MockDatabase(logger, config)
     db.create_database()
     db.set_coins(config.SUPPORTED_COIN_LIST)
-    manager = MockBinanceManager(config, db, logger, start_date, start_balances)
+    manager = MockBinanceManager(
+        config, db, logger, start_date, start_balances, store, snapshot, fill_gaps, RESOLUTIONS.get(resolution, 1)
+    )
+
+    if resolution not in RESOLUTIONS:
+        logger.error(f"Invalid resolution, must be one of {', '.join(RESOLUTIONS)}")
+        return manager
+    # Number of minutes between each scout
+    step = interval * RESOLUTIONS[resolution]
+
+    if (vectorized or skip_idle) and config.STRATEGY != "default":
+        logger.error("Vectorized and idle skipping backtests only support the default strategy")
+        return manager
+    if (vectorized or skip_idle) and config.MAX_JUMP_HOPS > 1:
+        logger.error("Vectorized and idle skipping backtests only support direct jumps")
+        return manager
+
+    if prefetch or vectorized or skip_idle:
+        manager.prefetch(get_backtest_symbols(config, manager.balances), end_date)
 
     starting_coin = db.get_coin(starting_coin or config.SUPPORTED_COIN_LIST[0])
     if manager.get_currency_balance(starting_coin.symbol) == 0:
@@ -191,18 +551,46 @@ def backtest(
 
     yield manager
 
+    if vectorized:
+        try:
+            yield from VectorizedBacktest(
+                trader, manager, db, logger, config, store, step, fill_gaps, RESOLUTIONS[resolution]
+            ).run(end_date, yield_interval)
+        except KeyboardInterrupt:
+            pass
+        store.close()
+        return manager
+
+    skipper = (
+        VectorizedBacktest(trader, manager, db, logger, config, store, step, fill_gaps, RESOLUTIONS[resolution])
+        if skip_idle
+        else None
+    )
+    steps = skipper.count_steps(end_date) if skip_idle else None
+
     n = 1
     try:
         while manager.datetime < end_date:
+            if skipper is not None:
+                # Jump over the steps where scouting can't do anything, stopping at the next yield
+                idle_steps = skipper.idle_steps(n - 1, min(steps, ((n - 1) // yield_interval + 1) * yield_interval))
+                if idle_steps:
+                    manager.increment(idle_steps * step)
+                    n += idle_steps
+                    if (n - 1) % yield_interval == 0:
+                        yield manager
+                    continue
             try:
                 trader.scout()
             except Exception:  # pylint: disable=broad-except
                 logger.warning(format_exc())
-            manager.increment(interval)
+            manager.increment(step)
             if n % yield_interval == 0:
                 yield manager
             n += 1
+            if skipper is not None:
+                skipper.sync()
     except KeyboardInterrupt:
         pass
-    cache.close()
+    store.close()
     return manager
@@ -1,7 +1,7 @@
 import math
 import time
 import traceback
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from binance.client import Client
 from binance.exceptions import BinanceAPIException
@@ -73,6 +73,14 @@ class BinanceAPIManager:
             return base_fee * 0.75
         return base_fee
 
+    def get_fee_state(self):
+        """
+        Get what the fees depend on besides the traded amounts, so that fees computed earlier can be
+        reused until it changes
+        """
+        using_bnb = self.get_using_bnb_for_fees()
+        return using_bnb, self.get_currency_balance("BNB") if using_bnb else None
+
     def get_account(self):
         """
         Get account information
@@ -85,9 +93,9 @@ class BinanceAPIManager:
         """
         price = self.cache.ticker_values.get(ticker_symbol, None)
         if price is None and ticker_symbol not in self.cache.non_existent_tickers:
-            self.cache.ticker_values = {
-                ticker["symbol"]: float(ticker["price"]) for ticker in self.binance_client.get_symbol_ticker()
-            }
+            self.cache.update_ticker_values(
+                {ticker["symbol"]: float(ticker["price"]) for ticker in self.binance_client.get_symbol_ticker()}
+            )
             self.logger.debug(f"Fetched all ticker prices: {self.cache.ticker_values}")
             price = self.cache.ticker_values.get(ticker_symbol, None)
             if price is None:
@@ -96,6 +104,22 @@ class BinanceAPIManager:
 
         return price
 
+    def wait_for_ticker_updates(self, timeout: float):
+        """
+        Wait until the price of some tickers changes on the stream, for at most `timeout` seconds
+
+        :return: The ticker symbols whose price changed since the last call
+        """
+        return self.cache.wait_for_ticker_updates(timeout)
+
+    def get_ticker_changes(self, cursor: Optional[int]):
+        """
+        Get the ticker symbols whose price changed since the cursor returned by the previous call
+
+        :return: The changed symbols, or None if any of them may have changed, and the next cursor
+        """
+        return self.cache.get_ticker_changes(cursor)
+
     def get_currency_balance(self, currency_symbol: str, force=False) -> float:
         """
         Get balance of a specific coin
@@ -118,6 +142,24 @@ class BinanceAPIManager:
 
             return balance
 
+    def get_currency_balances(self, currency_symbols: List[str]) -> Dict[str, float]:
+        """
+        Get the balances of several coins at once, all the balances are fetched if any of them isn't known
+        """
+        with self.cache.open_balances() as cache_balances:
+            if any(symbol not in cache_balances for symbol in currency_symbols):
+                cache_balances.clear()
+                cache_balances.update(
+                    {
+                        currency_balance["asset"]: float(currency_balance["free"])
+                        for currency_balance in self.binance_client.get_account()["balances"]
+                    }
+                )
+                self.logger.debug(f"Fetched all balances: {cache_balances}")
+                for symbol in currency_symbols:
+                    cache_balances.setdefault(symbol, 0.0)
+            return {symbol: cache_balances[symbol] for symbol in currency_symbols}
+
     def retry(self, func, *args, **kwargs):
         for attempt in range(20):
             try:
@@ -1,8 +1,9 @@
 import sys
 import threading
 import time
+from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Dict, Set, Tuple
+from typing import Dict, Optional, Set, Tuple
 
 import binance.client
 from binance.exceptions import BinanceAPIException, BinanceRequestException
@@ -34,12 +35,72 @@ class BinanceCache:  # pylint: disable=too-few-public-methods
     _balances_mutex: threading.Lock = threading.Lock()
     non_existent_tickers: Set[str] = set()
     orders: Dict[str, BinanceOrder] = {}
+    _ticker_updates: Set[str] = set()
+    _ticker_condition: threading.Condition = threading.Condition()
+    # Sequence number of the last change of each ticker, ordered from the least to the most recently changed
+    _ticker_sequences: "OrderedDict[str, int]" = OrderedDict()
+    _ticker_sequence = 0
+    # Only the changes of these tickers wake up wait_for_ticker_updates(), or of any ticker when None
+    _watched_tickers: Optional[Set[str]] = None
 
     @contextmanager
     def open_balances(self):
         with self._balances_mutex:
             yield self._balances
 
+    def watch_tickers(self, symbols: Optional[Set[str]]):
+        """
+        Only wake up wait_for_ticker_updates() when the price of one of the given tickers changes
+        """
+        with self._ticker_condition:
+            self._watched_tickers = symbols
+
+    def update_ticker_values(self, values: Dict[str, float]):
+        """
+        Store new ticker prices, and wake up whoever waits for the watched ones that changed
+        """
+        with self._ticker_condition:
+            changed = {symbol for symbol, price in values.items() if self.ticker_values.get(symbol) != price}
+            self.ticker_values.update(values)
+            for symbol in changed:
+                self._ticker_sequence += 1
+                self._ticker_sequences[symbol] = self._ticker_sequence
+                self._ticker_sequences.move_to_end(symbol)
+            if self._watched_tickers is not None:
+                changed &= self._watched_tickers
+            if changed:
+                self._ticker_updates.update(changed)
+                self._ticker_condition.notify_all()
+
+    def wait_for_ticker_updates(self, timeout: float) -> Set[str]:
+        """
+        Wait until some ticker prices change, for at most `timeout` seconds
+
+        :return: The symbols whose price changed since the last call
+        """
+        with self._ticker_condition:
+            if not self._ticker_updates and timeout > 0:
+                self._ticker_condition.wait(timeout)
+            updates = set(self._ticker_updates)
+            self._ticker_updates.clear()
+            return updates
+
+    def get_ticker_changes(self, cursor: Optional[int]) -> Tuple[Optional[Set[str]], int]:
+        """
+        Get the tickers whose price changed after the given cursor, in time proportional to their number
+
+        :return: The changed symbols, or None if there's no cursor yet, and the cursor to pass next time
+        """
+        with self._ticker_condition:
+            if cursor is None:
+                return None, self._ticker_sequence
+            changed = set()
+            for symbol, sequence in reversed(self._ticker_sequences.items()):
+                if sequence <= cursor:
+                    break
+                changed.add(symbol)
+            return changed, self._ticker_sequence
+
 
 class OrderGuard:
     def __init__(self, pending_orders: Set[Tuple[str, int]], mutex: threading.Lock):
@@ -75,6 +136,8 @@ class BinanceStreamManager:
     ):
         self.cache = cache
         self.logger = logger
+        # The stream has the price of every symbol of the exchange, only the coins against the bridge are scouted
+        self.cache.watch_tickers({coin + config.BRIDGE.symbol for coin in config.SUPPORTED_COIN_LIST})
         self.bw_api_manager = BinanceWebSocketApiManager(
             output_default="UnicornFy",
             enable_stream_signal_buffer=True,
@@ -178,8 +241,9 @@ class BinanceStreamManager:
                 for bal in stream_data["balances"]:
                     balances[bal["asset"]] = float(bal["free"])
         elif event_type == "24hrMiniTicker":
-            for event in stream_data["data"]:
-                self.cache.ticker_values[event["symbol"]] = float(event["close_price"])
+            self.cache.update_ticker_values(
+                {event["symbol"]: float(event["close_price"]) for event in stream_data["data"]}
+            )
         else:
             self.logger.error(f"Unknown event type found: {event_type}\n{stream_data}")
 
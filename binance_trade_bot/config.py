@@ -9,7 +9,11 @@ USER_CFG_SECTION = "binance_user_config"
 
 
 class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
-    def __init__(self):
+    def __init__(self, **overrides):
+        """
+        Reads the configuration from user.cfg and the environment.
+        Any attribute can be overridden with keyword arguments, e.g. Config(SCOUT_MULTIPLIER=3, USE_MARGIN="no")
+        """
         # Init config
         config = configparser.ConfigParser()
         config["DEFAULT"] = {
@@ -18,6 +22,9 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
             "scout_multiplier": "5",
             "scout_margin": "0.8",
             "scout_sleep_time": "5",
+            "scout_on_ticks": "no",
+            "scout_min_interval": "0.5",
+            "max_jump_hops": "1",
             "hourToKeepScoutHistory": "1",
             "tld": "com",
             "strategy": "default",
@@ -46,6 +53,11 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
         self.SCOUT_SLEEP_TIME = int(
             os.environ.get("SCOUT_SLEEP_TIME") or config.get(USER_CFG_SECTION, "scout_sleep_time")
         )
+        self.SCOUT_ON_TICKS = os.environ.get("SCOUT_ON_TICKS") or config.get(USER_CFG_SECTION, "scout_on_ticks")
+        self.SCOUT_MIN_INTERVAL = float(
+            os.environ.get("SCOUT_MIN_INTERVAL") or config.get(USER_CFG_SECTION, "scout_min_interval")
+        )
+        self.MAX_JUMP_HOPS = int(os.environ.get("MAX_JUMP_HOPS") or config.get(USER_CFG_SECTION, "max_jump_hops"))
 
         # Get config for binance
         self.BINANCE_API_KEY = os.environ.get("API_KEY") or config.get(USER_CFG_SECTION, "api_key")
@@ -75,3 +87,10 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
 
         self.USE_MARGIN = os.environ.get("USE_MARGIN") or config.get(USER_CFG_SECTION, "use_margin")
         self.SCOUT_MARGIN = float(os.environ.get("SCOUT_MARGIN") or config.get(USER_CFG_SECTION, "scout_margin"))
+
+        for name, value in overrides.items():
+            if not hasattr(self, name):
+                raise AttributeError(f"Unknown configuration option: {name}")
+            setattr(self, name, value)
+        if "BRIDGE_SYMBOL" in overrides:
+            self.BRIDGE = Coin(self.BRIDGE_SYMBOL, False)
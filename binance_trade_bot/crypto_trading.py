@@ -1,6 +1,8 @@
 #!python3
 import time
+from traceback import format_exc
 
+from .auto_trader import AutoTrader
 from .binance_api_manager import BinanceAPIManager
 from .config import Config
 from .database import Database
@@ -8,6 +10,33 @@ from .logger import Logger
 from .scheduler import SafeScheduler
 from .strategies import get_strategy
 
+# Seconds to wait after a price update for the rest of the burst to arrive, so that it's scouted at once
+TICK_DEBOUNCE = 0.02
+
+
+def scout_on_ticks(
+    trader: AutoTrader, manager: BinanceAPIManager, schedule: SafeScheduler, config: Config, logger: Logger
+):
+    """
+    Scout as soon as the stream brings new prices, instead of every SCOUT_SLEEP_TIME seconds. Scouts are
+    at least SCOUT_MIN_INTERVAL seconds apart, the updates arriving in between are scouted together.
+    """
+    last_scout = 0.0
+    while True:
+        schedule.run_pending()
+        ticker_symbols = manager.wait_for_ticker_updates(1)
+        if not ticker_symbols:
+            continue
+
+        time.sleep(max(TICK_DEBOUNCE, last_scout + config.SCOUT_MIN_INTERVAL - time.monotonic()))
+        ticker_symbols |= manager.wait_for_ticker_updates(0)
+
+        last_scout = time.monotonic()
+        try:
+            trader.scout_changes(ticker_symbols)
+        except Exception:  # pylint: disable=broad-except
+            logger.error(f"Error while scouting...\n{format_exc()}")
+
 
 def main():
     logger = Logger()
@@ -37,15 +66,22 @@ def main():
     db.migrate_old_state()
 
     trader.initialize()
+    trader.ratios.start_writer()
+    db.start_writer()
 
     schedule = SafeScheduler(logger)
-    schedule.every(config.SCOUT_SLEEP_TIME).seconds.do(trader.scout).tag("scouting")
+    if config.SCOUT_ON_TICKS != "yes":
+        schedule.every(config.SCOUT_SLEEP_TIME).seconds.do(trader.scout).tag("scouting")
     schedule.every(1).minutes.do(trader.update_values).tag("updating value history")
     schedule.every(1).minutes.do(db.prune_scout_history).tag("pruning scout history")
     schedule.every(1).hours.do(db.prune_value_history).tag("pruning value history")
     try:
+        if config.SCOUT_ON_TICKS == "yes":
+            scout_on_ticks(trader, manager, schedule, config, logger)
         while True:
             schedule.run_pending()
             time.sleep(1)
     finally:
+        trader.ratios.close()
+        db.stop_writer()
         manager.stream_manager.close()
@@ -1,28 +1,141 @@
 import json
 import os
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future
 from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import List, Optional, Union
+from queue import Empty, Queue
+from traceback import format_exc
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Union
 
 from socketio import Client
 from socketio.exceptions import ConnectionError as SocketIOConnectionError
-from sqlalchemy import create_engine, func
-from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy import MetaData, Table, create_engine, event, func, inspect, or_, select, text
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Session, noload, scoped_session, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.pool import QueuePool
 
 from .config import Config
 from .logger import Logger
 from .models import *  # pylint: disable=wildcard-import
 
+# The writer thread commits at most this many queued writes in one transaction
+WRITE_BATCH_SIZE = 1000
+# Scout history is written in batches, at least this often (in seconds) or as soon as a batch is full
+SCOUT_HISTORY_FLUSH_INTERVAL = 1
+SCOUT_HISTORY_BATCH_SIZE = 1000
+# Records waiting to be written beyond this are dropped, oldest first
+SCOUT_HISTORY_BUFFER_SIZE = 100000
+# Scout history is stored in one table per hour, named after the hour with this format
+SCOUT_HISTORY_BUCKET_FORMAT = "%Y%m%d%H"
+# Set on every connection to a SQLite database file
+SQLITE_PRAGMAS = {
+    # In WAL mode a commit doesn't need a sync to be safe from the application crashing
+    "synchronous": "NORMAL",
+    # Negative sizes are in KiB
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    # Milliseconds to wait for the other process to release its lock before failing
+    "busy_timeout": 10000,
+}
+# How long the value history of each interval is kept, weekly values are kept forever
+VALUE_HISTORY_RETENTION = {
+    Interval.MINUTELY: timedelta(hours=24),
+    Interval.HOURLY: timedelta(days=28),
+    Interval.DAILY: timedelta(days=365),
+}
+
+
+def create_sqlite_engine(uri: str, read_only=False):
+    """
+    Create the engine of a database, tuned when it's a SQLite file.
+
+    The database is switched to WAL mode, so that readers (the API server) and the writer (the bot) no longer block
+    each other. Connections are pooled so that their page cache outlives a session. A read-only engine opens the file
+    in read-only mode, and can't take a write lock by mistake.
+    """
+    url = make_url(uri)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return create_engine(url)
+
+    if read_only:
+        url = url.set(database=f"file:{url.database}").update_query_dict({"mode": "ro", "uri": "true"})
+    engine = create_engine(url, poolclass=QueuePool, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+
+def get_snapshot_interval(previous: Optional[datetime], snapshot: datetime) -> Interval:
+    """
+    Get the longest interval whose period starts with a value snapshot, given the time of the snapshot before it.
+    The periods are the same as the ones of prune_value_history().
+    """
+    hour = snapshot.replace(minute=0, second=0, microsecond=0)
+    day = hour.replace(hour=0)
+    # Weeks start on Monday, except the first one of a year which starts on January 1st
+    week = max(day - timedelta(days=day.weekday()), day.replace(month=1, day=1))
+    for interval, start in ((Interval.WEEKLY, week), (Interval.DAILY, day), (Interval.HOURLY, hour)):
+        if previous is None or previous < start:
+            return interval
+    return Interval.MINUTELY
+
+
+def _sum_values(values: List[Optional[float]]) -> Optional[float]:
+    # Like SUM() in SQL, missing values are left out
+    values = [value for value in values if value is not None]
+    return sum(values) if values else None
+
 
 class Database:
-    def __init__(self, logger: Logger, config: Config, uri="sqlite:///data/crypto_trading.db"):
+    def __init__(
+        self, logger: Logger, config: Config, uri="sqlite:///data/crypto_trading.db", cache=True, read_only=False
+    ):
         self.logger = logger
         self.config = config
-        self.engine = create_engine(uri)
+        self.engine = create_sqlite_engine(uri, read_only)
         self.SessionMaker = sessionmaker(bind=self.engine)
         self.socketio_client = Client()
 
+        # The coins, pairs and current coin are kept in memory, so that reading them doesn't query the database.
+        # This is only correct in the process that makes all the changes to them, other readers must disable it.
+        # The cached objects are detached and shared between callers: they must only be changed through this class.
+        self.cache = cache
+        self._coins: Optional[Dict[str, Coin]] = None
+        self._pairs: Optional[Dict[Tuple[str, str], Pair]] = None
+        self._pairs_from: Dict[str, List[Pair]] = {}
+        self._pairs_to: Dict[str, List[Pair]] = {}
+        self._current_coin: Optional[str] = None
+
+        # While the writer is running, every write is queued here and made by the writer thread, in order.
+        # None only wakes the writer up.
+        self._writes: "Queue[Optional[Tuple[Callable[[Session], Any], Future]]]" = Queue()
+        self._writer_stop = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+
+        self._scout_history: Deque[ScoutHistory] = deque(maxlen=SCOUT_HISTORY_BUFFER_SIZE)
+        self._scout_history_dropped = 0
+        self._scout_history_buckets_mutex = threading.Lock()
+        self._created_scout_history_buckets = set()
+        # The tables of the hours are only known to this instance, so that they aren't kept for the whole process
+        # nor created by create_all(). The pairs table is there for their foreign key to refer to.
+        self._scout_history_metadata = MetaData()
+        Pair.__table__.to_metadata(self._scout_history_metadata)
+
+        # Id of the last value history entry that prune_value_history() went through
+        self._value_history_high_water = 0
+
     def socketio_connect(self):
         if self.socketio_client.connected and self.socketio_client.namespaces:
             return True
@@ -41,42 +154,193 @@ class Database:
         Creates a context with an open SQLAlchemy session.
         """
         session: Session = scoped_session(self.SessionMaker)
-        yield session
-        session.commit()
-        session.close()
+        try:
+            yield session
+            session.commit()
+        finally:
+            session.close()
+
+    def write(self, fn: Callable[[Session], Any], sync=False) -> Future:
+        """
+        Make a write to the database: `fn` is called with a session, which is then committed. With the writer
+        running, it happens later in the writer thread, and the returned future gives the result of `fn` once
+        it's committed. Writes that must survive a crash can ask for `sync`, to wait until then.
+        """
+        future = Future()
+        if self._writer is None:
+            self._commit([(fn, future)])
+        else:
+            self._writes.put((fn, future))
+        if sync:
+            future.result()
+        return future
+
+    def _commit(self, writes: List[Tuple[Callable[[Session], Any], Future]]):
+        """
+        Make the given writes in a single transaction. When one of them fails, they are made again one by one,
+        so that only the failing one is lost.
+        """
+        if not writes:
+            return
+        # The models written are read again once committed, e.g. to send them to the API server
+        session: Session = self.SessionMaker(expire_on_commit=False)
+        try:
+            results = [fn(session) for fn, _ in writes]
+            session.commit()
+        except Exception as e:  # pylint: disable=broad-except
+            # Release the transaction before making the writes again
+            session.close()
+            if len(writes) > 1:
+                for write in writes:
+                    self._commit([write])
+                return
+            self.logger.warning(format_exc())
+            writes[0][1].set_exception(e)
+            return
+        finally:
+            session.close()
+        for (_, future), result in zip(writes, results):
+            future.set_result(result)
+
+    def _write(self):
+        while True:
+            try:
+                writes = [self._writes.get(timeout=SCOUT_HISTORY_FLUSH_INTERVAL)]
+            except Empty:
+                writes = []
+            while len(writes) < WRITE_BATCH_SIZE:
+                try:
+                    writes.append(self._writes.get_nowait())
+                except Empty:
+                    break
+            writes = [write for write in writes if write is not None]
+            stopping = self._writer_stop.is_set()
+
+            try:
+                scout_history = self._take_scout_history()
+                if scout_history is not None:
+                    future = Future()
+                    future.add_done_callback(self.send_written)
+                    writes.append((scout_history, future))
+            except Exception:  # pylint: disable=broad-except
+                self.logger.warning(format_exc())
+            self._commit(writes)
+
+            if stopping and self._writes.empty():
+                return
+
+    def start_writer(self):
+        """
+        Make all the writes from a single background thread, which groups them into transactions. Scouting and
+        trading then only wait on the disk for the writes that ask for it.
+        """
+        self._writer_stop.clear()
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def stop_writer(self):
+        """
+        Stop the background writer, once it made everything that was queued
+        """
+        if self._writer is None:
+            return
+        self._writer_stop.set()
+        self._writes.put(None)
+        self._writer.join()
+        self._writer = None
+
+        # Anything queued while the writer was stopping
+        writes = []
+        while not self._writes.empty():
+            write = self._writes.get_nowait()
+            if write is not None:
+                writes.append(write)
+        self._commit(writes)
+        self.flush_scout_history()
+
+    def _load_cache(self):
+        session: Session
+        with self.db_session() as session:
+            coins = {coin.symbol: coin for coin in session.query(Coin).all()}
+            # Rather than joining the coins to every pair row, the pairs are given the coin objects already loaded
+            pairs = session.query(Pair).options(noload(Pair.from_coin), noload(Pair.to_coin)).all()
+            for pair in pairs:
+                set_committed_value(pair, "from_coin", coins[pair.from_coin_id])
+                set_committed_value(pair, "to_coin", coins[pair.to_coin_id])
+            current_coin = session.query(CurrentCoin).order_by(CurrentCoin.datetime.desc()).first()
+            current_coin_symbol = current_coin.coin_id if current_coin is not None else None
+            session.expunge_all()
+
+        self._pairs_from = {symbol: [] for symbol in coins}
+        self._pairs_to = {symbol: [] for symbol in coins}
+        for pair in pairs:
+            self._pairs_from[pair.from_coin_id].append(pair)
+            self._pairs_to[pair.to_coin_id].append(pair)
+        self._pairs = {(pair.from_coin_id, pair.to_coin_id): pair for pair in pairs}
+        self._current_coin = current_coin_symbol
+        self._coins = coins
+
+    def _cached_coins(self) -> Dict[str, Coin]:
+        if self._coins is None:
+            self._load_cache()
+        return self._coins
+
+    def invalidate_cache(self):
+        """
+        Forget the cached coins, pairs and current coin, they are loaded again when they are next needed
+        """
+        self._coins = None
+        self._pairs = None
 
     def set_coins(self, symbols: List[str]):
+        self.invalidate_cache()
+        symbols = list(dict.fromkeys(symbols))
+        enabled_symbols = set(symbols)
         session: Session
 
-        # Add coins to the database and set them as enabled or not
         with self.db_session() as session:
-            # For all the coins in the database, if the symbol no longer appears
-            # in the config file, set the coin as disabled
-            coins: List[Coin] = session.query(Coin).all()
-            for coin in coins:
-                if coin.symbol not in symbols:
-                    coin.enabled = False
-
-            # For all the symbols in the config file, add them to the database
-            # if they don't exist
-            for symbol in symbols:
-                coin = next((coin for coin in coins if coin.symbol == symbol), None)
-                if coin is None:
-                    session.add(Coin(symbol))
-                else:
-                    coin.enabled = True
-
-        # For all the combinations of coins in the database, add a pair to the database
-        with self.db_session() as session:
-            coins: List[Coin] = session.query(Coin).filter(Coin.enabled).all()
-            for from_coin in coins:
-                for to_coin in coins:
-                    if from_coin != to_coin:
-                        pair = session.query(Pair).filter(Pair.from_coin == from_coin, Pair.to_coin == to_coin).first()
-                        if pair is None:
-                            session.add(Pair(from_coin, to_coin))
+            # Coins that no longer appear in the config file are disabled, and the ones that are missing are added
+            coins = dict(session.query(Coin.symbol, Coin.enabled).all())
+            session.bulk_update_mappings(
+                Coin,
+                [
+                    {"symbol": symbol, "enabled": symbol in enabled_symbols}
+                    for symbol, enabled in coins.items()
+                    if enabled != (symbol in enabled_symbols)
+                ],
+            )
+            new_symbols = [symbol for symbol in symbols if symbol not in coins]
+            session.bulk_insert_mappings(Coin, [{"symbol": symbol, "enabled": True} for symbol in new_symbols])
+
+            # Pairs are enabled when both their coins are, and every combination of enabled coins needs a pair
+            pairs = {
+                (from_coin_id, to_coin_id): (pair_id, enabled)
+                for pair_id, from_coin_id, to_coin_id, enabled in session.query(
+                    Pair.id, Pair.from_coin_id, Pair.to_coin_id, Pair.enabled
+                )
+            }
+            session.bulk_update_mappings(
+                Pair,
+                [
+                    {"id": pair_id, "enabled": from_coin_id in enabled_symbols and to_coin_id in enabled_symbols}
+                    for (from_coin_id, to_coin_id), (pair_id, enabled) in pairs.items()
+                    if enabled != (from_coin_id in enabled_symbols and to_coin_id in enabled_symbols)
+                ],
+            )
+            ordered_symbols = [symbol for symbol in list(coins) + new_symbols if symbol in enabled_symbols]
+            new_pairs = [
+                {"from_coin_id": from_coin_id, "to_coin_id": to_coin_id, "enabled": True}
+                for from_coin_id in ordered_symbols
+                for to_coin_id in ordered_symbols
+                if from_coin_id != to_coin_id and (from_coin_id, to_coin_id) not in pairs
+            ]
+            # There can be tens of thousands of them, so they skip the ORM and go in a single executemany
+            if new_pairs:
+                session.execute(Pair.__table__.insert(), new_pairs)
 
     def get_coins(self, only_enabled=True) -> List[Coin]:
+        if self.cache:
+            return [coin for coin in self._cached_coins().values() if coin.enabled or not only_enabled]
         session: Session
         with self.db_session() as session:
             if only_enabled:
@@ -89,6 +353,8 @@ class Database:
     def get_coin(self, coin: Union[Coin, str]) -> Coin:
         if isinstance(coin, Coin):
             return coin
+        if self.cache:
+            return self._cached_coins().get(coin)
         session: Session
         with self.db_session() as session:
             coin = session.query(Coin).get(coin)
@@ -97,15 +363,21 @@ class Database:
 
     def set_current_coin(self, coin: Union[Coin, str]):
         coin = self.get_coin(coin)
-        session: Session
-        with self.db_session() as session:
-            if isinstance(coin, Coin):
-                coin = session.merge(coin)
-            cc = CurrentCoin(coin)
+        symbol = coin.symbol
+
+        def add_current_coin(session: Session):
+            cc = CurrentCoin(session.merge(coin))
             session.add(cc)
-            self.send_update(cc)
+            return [cc]
+
+        # After a restart, the bot must know which coin it holds
+        self.write(add_current_coin, sync=True).add_done_callback(self.send_written)
+        self._current_coin = symbol
 
     def get_current_coin(self) -> Optional[Coin]:
+        if self.cache:
+            coins = self._cached_coins()
+            return coins[self._current_coin] if self._current_coin is not None else None
         session: Session
         with self.db_session() as session:
             current_coin = session.query(CurrentCoin).order_by(CurrentCoin.datetime.desc()).first()
@@ -118,6 +390,9 @@ class Database:
     def get_pair(self, from_coin: Union[Coin, str], to_coin: Union[Coin, str]):
         from_coin = self.get_coin(from_coin)
         to_coin = self.get_coin(to_coin)
+        if self.cache:
+            self._cached_coins()
+            return self._pairs.get((from_coin.symbol, to_coin.symbol))
         session: Session
         with self.db_session() as session:
             pair: Pair = session.query(Pair).filter(Pair.from_coin == from_coin, Pair.to_coin == to_coin).first()
@@ -126,6 +401,9 @@ class Database:
 
     def get_pairs_from(self, from_coin: Union[Coin, str], only_enabled=True) -> List[Pair]:
         from_coin = self.get_coin(from_coin)
+        if self.cache:
+            self._cached_coins()
+            return [pair for pair in self._pairs_from[from_coin.symbol] if pair.enabled or not only_enabled]
         session: Session
         with self.db_session() as session:
             pairs = session.query(Pair).filter(Pair.from_coin == from_coin)
@@ -135,7 +413,24 @@ class Database:
             session.expunge_all()
             return pairs
 
+    def get_pairs_to(self, to_coin: Union[Coin, str], only_enabled=True) -> List[Pair]:
+        to_coin = self.get_coin(to_coin)
+        if self.cache:
+            self._cached_coins()
+            return [pair for pair in self._pairs_to[to_coin.symbol] if pair.enabled or not only_enabled]
+        session: Session
+        with self.db_session() as session:
+            pairs = session.query(Pair).filter(Pair.to_coin == to_coin)
+            if only_enabled:
+                pairs = pairs.filter(Pair.enabled.is_(True))
+            pairs = pairs.all()
+            session.expunge_all()
+            return pairs
+
     def get_pairs(self, only_enabled=True) -> List[Pair]:
+        if self.cache:
+            self._cached_coins()
+            return [pair for pair in self._pairs.values() if pair.enabled or not only_enabled]
         session: Session
         with self.db_session() as session:
             pairs = session.query(Pair)
@@ -145,6 +440,18 @@ class Database:
             session.expunge_all()
             return pairs
 
+    def update_pair_ratios(self, pairs: List[Pair]):
+        """
+        Save the ratio of each of the given pairs
+        """
+        mappings = [{"id": pair.id, "ratio": pair.ratio} for pair in pairs]
+        self.write(lambda session: session.bulk_update_mappings(Pair, mappings), sync=True)
+        if self._pairs is not None:
+            for pair in pairs:
+                cached = self._pairs.get((pair.from_coin_id, pair.to_coin_id))
+                if cached is not None and cached is not pair:
+                    cached.ratio = pair.ratio
+
     def log_scout(
         self,
         pair: Pair,
@@ -152,80 +459,314 @@ class Database:
         current_coin_price: float,
         other_coin_price: float,
     ):
+        """
+        Record a scout. With the writer running, the record is only queued and written later.
+        """
+        sh = ScoutHistory(pair, target_ratio, current_coin_price, other_coin_price)
+        sh.pair_id = pair.id
+        if len(self._scout_history) == self._scout_history.maxlen:
+            self._scout_history_dropped += 1
+        self._scout_history.append(sh)
+
+        if self._writer is None:
+            self.flush_scout_history()
+        elif len(self._scout_history) == SCOUT_HISTORY_BATCH_SIZE:
+            self._writes.put(None)
+
+    def flush_scout_history(self):
+        """
+        Write all the queued scout records with a single bulk insert, when the writer isn't running
+        """
+        insert = self._take_scout_history()
+        if insert is not None:
+            self.write(insert).add_done_callback(self.send_written)
+
+    def _take_scout_history(self) -> Optional[Callable[[Session], List[ScoutHistory]]]:
+        """
+        Take the queued scout records, and get the write that inserts them and returns them
+        """
+        records = []
+        while self._scout_history:
+            records.append(self._scout_history.popleft())
+        if self._scout_history_dropped:
+            self.logger.warning(f"Scout history can't keep up, dropped {self._scout_history_dropped} records")
+            self._scout_history_dropped = 0
+        if not records:
+            return None
+
+        rows: Dict[datetime, List[dict]] = {}
+        for sh in records:
+            rows.setdefault(sh.datetime.replace(minute=0, second=0, microsecond=0), []).append(
+                {
+                    "pair_id": sh.pair_id,
+                    "target_ratio": sh.target_ratio,
+                    "current_coin_price": sh.current_coin_price,
+                    "other_coin_price": sh.other_coin_price,
+                    "datetime": sh.datetime,
+                }
+            )
+        # Created now rather than in the write, which would wait on its own transaction for the table to exist
+        tables = {hour: self._get_scout_history_bucket(hour, create=True) for hour in rows}
+
+        def insert(session: Session):
+            for hour, bucket_rows in rows.items():
+                session.execute(tables[hour].insert(), bucket_rows)
+            return records
+
+        return insert
+
+    def send_written(self, future: Future):
+        """
+        Send the models returned by a write to the API server, once the write is committed. To be added as a done
+        callback of the future of the write, rather than sending them from the transaction, which a slow API
+        server would hold up.
+        """
+        if future.exception() is None:
+            self.send_updates(future.result())
+
+    def _get_scout_history_bucket(self, hour: datetime, create=False) -> Table:
+        """
+        Get the table of the scout history of an hour, with the same columns as the scout_history table
+        """
+        name = f"{ScoutHistory.__tablename__}_{hour.strftime(SCOUT_HISTORY_BUCKET_FORMAT)}"
+        with self._scout_history_buckets_mutex:
+            table = self._scout_history_metadata.tables.get(name)
+            if table is None:
+                table = ScoutHistory.__table__.to_metadata(self._scout_history_metadata, name=name)
+                # Index names are global to the database, so each table needs its own
+                for index in table.indexes:
+                    index.name = index.name.replace(ScoutHistory.__tablename__, name, 1)
+            if create and name not in self._created_scout_history_buckets:
+                table.create(self.engine, checkfirst=True)
+                self._created_scout_history_buckets.add(name)
+        return table
+
+    def _list_scout_history_buckets(self) -> List[datetime]:
+        """
+        Get the hours that have a scout history table in the database, oldest first
+        """
+        prefix = ScoutHistory.__tablename__ + "_"
+        names = set(inspect(self.engine).get_table_names())
+        hours = []
+        for name in names:
+            if name.startswith(prefix):
+                try:
+                    hours.append(datetime.strptime(name[len(prefix) :], SCOUT_HISTORY_BUCKET_FORMAT))
+                except ValueError:
+                    continue
+
+        # Forget the tables that were dropped meanwhile, by another process or connection
+        with self._scout_history_buckets_mutex:
+            for table in list(self._scout_history_metadata.tables.values()):
+                if table.name.startswith(prefix) and table.name not in names:
+                    self._scout_history_metadata.remove(table)
+                    self._created_scout_history_buckets.discard(table.name)
+        return sorted(hours)
+
+    def get_scout_history(self, from_coin: Union[Coin, str], since: datetime = None) -> List[ScoutHistory]:
+        """
+        Get the scouts from a coin, oldest first. Only the tables of the hours after `since` are read.
+        """
+        from_coin = self.get_coin(from_coin)
+        if from_coin is None:
+            return []
+        scouts = []
         session: Session
         with self.db_session() as session:
-            pair = session.merge(pair)
-            sh = ScoutHistory(pair, target_ratio, current_coin_price, other_coin_price)
-            session.add(sh)
-            self.send_update(sh)
+            for hour in self._list_scout_history_buckets():
+                if since is not None and hour + timedelta(hours=1) <= since:
+                    continue
+                table = self._get_scout_history_bucket(hour)
+                query = (
+                    session.query(table, Pair)
+                    .join(Pair, Pair.id == table.c.pair_id)
+                    .filter(Pair.from_coin_id == from_coin.symbol)
+                    .order_by(table.c.datetime.asc())
+                )
+                if since is not None:
+                    query = query.filter(table.c.datetime >= since)
+                for row in query:
+                    sh = ScoutHistory(row.Pair, row.target_ratio, row.current_coin_price, row.other_coin_price)
+                    sh.datetime = row.datetime
+                    scouts.append(sh)
+            session.expunge_all()
+        return scouts
+
+    def log_values(self, values: List[CoinValue]):
+        def add_values(session: Session):
+            snapshots: Dict[datetime, List[CoinValue]] = {}
+            for cv in values:
+                cv.coin = session.merge(cv.coin)
+                session.add(cv)
+                snapshots.setdefault(cv.datetime, []).append(cv)
+
+            # Keep the total value history up to date with the same write
+            previous = session.query(func.max(PortfolioValue.datetime)).scalar()
+            for snapshot in sorted(snapshots):
+                snapshot_values = snapshots[snapshot]
+                session.add(
+                    PortfolioValue(
+                        _sum_values([cv.btc_value for cv in snapshot_values]),
+                        _sum_values([cv.usd_value for cv in snapshot_values]),
+                        get_snapshot_interval(previous, snapshot),
+                        snapshot,
+                    )
+                )
+                previous = snapshot
+            return values
+
+        self.write(add_values).add_done_callback(self.send_written)
 
     def prune_scout_history(self):
-        time_diff = datetime.now() - timedelta(hours=self.config.SCOUT_HISTORY_PRUNE_TIME)
-        session: Session
-        with self.db_session() as session:
-            session.query(ScoutHistory).filter(ScoutHistory.datetime < time_diff).delete()
+        self.write(self._prune_scout_history)
+
+    def _prune_scout_history(self, session: Session):
+        # Scouts are logged in UTC
+        time_diff = datetime.utcnow() - timedelta(hours=self.config.SCOUT_HISTORY_PRUNE_TIME)
+
+        # The table of an hour is dropped as a whole, once all its scouts are past the retention time
+        for hour in self._list_scout_history_buckets():
+            if hour + timedelta(hours=1) > time_diff:
+                break
+            table = self._get_scout_history_bucket(hour)
+            with self._scout_history_buckets_mutex:
+                table.drop(session.connection(), checkfirst=True)
+                self._scout_history_metadata.remove(table)
+                self._created_scout_history_buckets.discard(table.name)
+
+        # Scouts logged before the scout history was split by hour
+        session.query(ScoutHistory).filter(ScoutHistory.datetime < time_diff).delete()
 
     def prune_value_history(self):
-        session: Session
-        with self.db_session() as session:
+        def set_high_water(future: Future):
+            # Only once the transaction is committed: if it's rolled back, the write is made again from the old mark
+            if future.exception() is None:
+                self._value_history_high_water = future.result()
+
+        self.write(self._prune_value_history).add_done_callback(set_high_water)
+
+    def _prune_value_history(self, session: Session) -> int:
+        """
+        :return: The id of the last entry that was looked at, to start from next time
+        """
+        # Only the periods that got new entries since the last run need to be looked at
+        high_water = session.query(func.max(CoinValue.id)).scalar() or 0
+        first_new = (
+            session.query(func.min(CoinValue.datetime)).filter(CoinValue.id > self._value_history_high_water).scalar()
+        )
+        if first_new is not None:
+            # No period is longer than a week, so its first entry can't be older than this
+            window_start = first_new - timedelta(days=7)
+
             # Sets the first entry for each coin for each hour as 'hourly'
-            hourly_entries: List[CoinValue] = (
-                session.query(CoinValue).group_by(CoinValue.coin_id, func.strftime("%H", CoinValue.datetime)).all()
+            self._mark_first_values(
+                session, Interval.HOURLY, func.strftime("%Y-%m-%d %H", CoinValue.datetime), window_start
             )
-            for entry in hourly_entries:
-                entry.interval = Interval.HOURLY
 
             # Sets the first entry for each coin for each day as 'daily'
-            daily_entries: List[CoinValue] = (
-                session.query(CoinValue).group_by(CoinValue.coin_id, func.date(CoinValue.datetime)).all()
-            )
-            for entry in daily_entries:
-                entry.interval = Interval.DAILY
+            self._mark_first_values(session, Interval.DAILY, func.date(CoinValue.datetime), window_start)
 
             # Sets the first entry for each coin for each month as 'weekly'
             # (Sunday is the start of the week)
-            weekly_entries: List[CoinValue] = (
-                session.query(CoinValue).group_by(CoinValue.coin_id, func.strftime("%Y-%W", CoinValue.datetime)).all()
-            )
-            for entry in weekly_entries:
-                entry.interval = Interval.WEEKLY
-
-            # The last 24 hours worth of minutely entries will be kept, so
-            # count(coins) * 1440 entries
-            time_diff = datetime.now() - timedelta(hours=24)
-            session.query(CoinValue).filter(
-                CoinValue.interval == Interval.MINUTELY, CoinValue.datetime < time_diff
-            ).delete()
-
-            # The last 28 days worth of hourly entries will be kept, so count(coins) * 672 entries
-            time_diff = datetime.now() - timedelta(days=28)
-            session.query(CoinValue).filter(
-                CoinValue.interval == Interval.HOURLY, CoinValue.datetime < time_diff
-            ).delete()
-
-            # The last years worth of daily entries will be kept, so count(coins) * 365 entries
-            time_diff = datetime.now() - timedelta(days=365)
-            session.query(CoinValue).filter(
-                CoinValue.interval == Interval.DAILY, CoinValue.datetime < time_diff
-            ).delete()
-
-            # All weekly entries will be kept forever
+            self._mark_first_values(session, Interval.WEEKLY, func.strftime("%Y-%W", CoinValue.datetime), window_start)
+
+        # The last 24 hours worth of minutely entries will be kept, so count(coins) * 1440 entries.
+        # The last 28 days worth of hourly entries will be kept, so count(coins) * 672 entries.
+        # The last years worth of daily entries will be kept, so count(coins) * 365 entries.
+        # The portfolio totals are kept for as long as the entries they were summed from.
+        for interval, retention in VALUE_HISTORY_RETENTION.items():
+            time_diff = datetime.now() - retention
+            for model in (CoinValue, PortfolioValue):
+                session.query(model).filter(model.interval == interval, model.datetime < time_diff).delete()
+
+        # All weekly entries will be kept forever
+        return high_water
+
+    def _mark_first_values(self, session: Session, interval: Interval, period, window_start: datetime):
+        """
+        Set the interval of the first entry of each coin in each period that got new entries since the last run.
+        Entries are only ever moved to a longer interval, so marking a period again changes nothing.
+        """
+        first_entries = (
+            session.query(func.min(CoinValue.id))
+            .filter(CoinValue.datetime >= window_start)
+            .group_by(CoinValue.coin_id, period)
+            .having(func.max(CoinValue.id) > self._value_history_high_water)
+        )
+        shorter_intervals = list(Interval)[: list(Interval).index(interval)]
+        session.query(CoinValue).filter(
+            CoinValue.id.in_(first_entries.scalar_subquery()), CoinValue.interval.in_(shorter_intervals)
+        ).update({CoinValue.interval: interval}, synchronize_session=False)
 
     def create_database(self):
         Base.metadata.create_all(self.engine)
+        self.migrate_schema()
+
+    def migrate_schema(self):
+        """
+        Bring the tables of a database created by an older version up to date
+        """
+        pair_columns = {column["name"] for column in inspect(self.engine).get_columns(Pair.__tablename__)}
+        if "enabled" not in pair_columns:
+            self.logger.info("Adding the enabled column to the pairs table")
+            with self.engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE {Pair.__tablename__} ADD COLUMN enabled BOOLEAN"))
+            enabled_coins = (
+                select([func.count(Coin.symbol)])
+                .where(or_(Coin.symbol == Pair.from_coin_id, Coin.symbol == Pair.to_coin_id))
+                .where(Coin.enabled.is_(True))
+                .scalar_subquery()
+            )
+            session: Session
+            with self.db_session() as session:
+                session.query(Pair).update({Pair.enabled: enabled_coins == 2}, synchronize_session=False)
+
+        # create_all() only creates the indexes of new tables
+        for model in (Pair, CoinValue, ScoutHistory, Trade, CurrentCoin):
+            for index in model.__table__.indexes:
+                index.create(self.engine, checkfirst=True)
+
+        with self.db_session() as session:
+            if session.query(PortfolioValue.id).first() is None and session.query(CoinValue.id).first() is not None:
+                self.logger.info("Filling the portfolio_value table from the value history")
+                snapshots = (
+                    session.query(CoinValue.datetime, func.sum(CoinValue.btc_value), func.sum(CoinValue.usd_value))
+                    .group_by(CoinValue.datetime)
+                    .order_by(CoinValue.datetime.asc())
+                )
+                rows = []
+                previous = None
+                for snapshot, btc_value, usd_value in snapshots:
+                    rows.append(
+                        {
+                            "btc_value": btc_value,
+                            "usd_value": usd_value,
+                            "interval": get_snapshot_interval(previous, snapshot),
+                            "datetime": snapshot,
+                        }
+                    )
+                    previous = snapshot
+                session.bulk_insert_mappings(PortfolioValue, rows)
 
     def start_trade_log(self, from_coin: Coin, to_coin: Coin, selling: bool):
         return TradeLog(self, from_coin, to_coin, selling)
 
     def send_update(self, model):
-        if not self.socketio_connect():
+        self.send_updates([model])
+
+    def send_updates(self, models: List[Base]):
+        """
+        Send several models to the API server, connecting to it at most once
+        """
+        if not models or not self.socketio_connect():
             return
 
-        self.socketio_client.emit(
-            "update",
-            {"table": model.__tablename__, "data": model.info()},
-            namespace="/backend",
-        )
+        for model in models:
+            self.socketio_client.emit(
+                "update",
+                {"table": model.__tablename__, "data": model.info()},
+                namespace="/backend",
+            )
 
     def migrate_old_state(self):
         """
@@ -244,15 +785,16 @@ class Database:
             with open(".current_coin_table") as f:
                 self.logger.info(f".current_coin_table file found, loading into database")
                 table: dict = json.load(f)
-                session: Session
-                with self.db_session() as session:
-                    for from_coin, to_coin_dict in table.items():
-                        for to_coin, ratio in to_coin_dict.items():
-                            if from_coin == to_coin:
-                                continue
-                            pair = session.merge(self.get_pair(from_coin, to_coin))
-                            pair.ratio = ratio
-                            session.add(pair)
+                pairs = []
+                for from_coin, to_coin_dict in table.items():
+                    for to_coin, ratio in to_coin_dict.items():
+                        if from_coin == to_coin:
+                            continue
+                        # The pair may be the cached one, which has to see the new ratio too
+                        pair = self.get_pair(from_coin, to_coin)
+                        pair.ratio = ratio
+                        pairs.append(pair)
+                self.update_pair_ratios(pairs)
 
             os.rename(".current_coin_table", ".current_coin_table.old")
             self.logger.info(".current_coin_table renamed to .current_coin_table.old - " "You can now delete this file")
@@ -261,33 +803,47 @@ class Database:
 class TradeLog:
     def __init__(self, db: Database, from_coin: Coin, to_coin: Coin, selling: bool):
         self.db = db
-        session: Session
-        with self.db.db_session() as session:
-            from_coin = session.merge(from_coin)
-            to_coin = session.merge(to_coin)
-            self.trade = Trade(from_coin, to_coin, selling)
-            session.add(self.trade)
+
+        def add_trade(session: Session):
+            trade = Trade(session.merge(from_coin), session.merge(to_coin), selling)
+            session.add(trade)
             # Flush so that SQLAlchemy fills in the id column
             session.flush()
-            self.db.send_update(self.trade)
+            return [trade]
+
+        self._added: Future = self.db.write(add_trade)
+        self._added.add_done_callback(self.db.send_written)
+
+    @property
+    def trade_id(self) -> int:
+        """
+        The id of the trade, once it's written. Raises the error of the write if it failed.
+        """
+        return self._added.result()[0].id
+
+    def _update(self, **values):
+        # A trade that couldn't be written must not be updated as if it were
+        trade_id = self.trade_id
+
+        def update_trade(session: Session):
+            trade: Trade = session.query(Trade).get(trade_id)
+            for name, value in values.items():
+                setattr(trade, name, value)
+            return [trade]
+
+        # The state of the trade must survive a crash, so this waits until it's written
+        self.db.write(update_trade, sync=True).add_done_callback(self.db.send_written)
 
     def set_ordered(self, alt_starting_balance, crypto_starting_balance, alt_trade_amount):
-        session: Session
-        with self.db.db_session() as session:
-            trade: Trade = session.merge(self.trade)
-            trade.alt_starting_balance = alt_starting_balance
-            trade.alt_trade_amount = alt_trade_amount
-            trade.crypto_starting_balance = crypto_starting_balance
-            trade.state = TradeState.ORDERED
-            self.db.send_update(trade)
+        self._update(
+            alt_starting_balance=alt_starting_balance,
+            alt_trade_amount=alt_trade_amount,
+            crypto_starting_balance=crypto_starting_balance,
+            state=TradeState.ORDERED,
+        )
 
     def set_complete(self, crypto_trade_amount):
-        session: Session
-        with self.db.db_session() as session:
-            trade: Trade = session.merge(self.trade)
-            trade.crypto_trade_amount = crypto_trade_amount
-            trade.state = TradeState.COMPLETE
-            self.db.send_update(trade)
+        self._update(crypto_trade_amount=crypto_trade_amount, state=TradeState.COMPLETE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+from typing import Any, Dict, Optional
+
+from binance.client import Client
+
+from .config import Config
+
+EXCHANGE_SNAPSHOT_PATH = "data/exchange_snapshot.json"
+
+
+class ExchangeSnapshot:
+    """
+    The exchange information (symbol filters) and trade fees of Binance at some point in time,
+    so that backtests can run without calling the API
+    """
+
+    def __init__(self, symbols: Dict[str, Dict[str, Any]], trade_fees: Dict[str, float]):
+        self.symbols = symbols
+        self.trade_fees = trade_fees
+
+    @classmethod
+    def download(cls, binance_client: Client) -> "ExchangeSnapshot":
+        symbols = {info["symbol"]: info for info in binance_client.get_exchange_info()["symbols"]}
+        trade_fees = {ticker["symbol"]: float(ticker["takerCommission"]) for ticker in binance_client.get_trade_fee()}
+        return cls(symbols, trade_fees)
+
+    @classmethod
+    def load(cls, path: str = EXCHANGE_SNAPSHOT_PATH) -> "ExchangeSnapshot":
+        with open(path) as f:
+            snapshot = json.load(f)
+        return cls(snapshot["symbols"], snapshot["trade_fees"])
+
+    def save(self, path: str = EXCHANGE_SNAPSHOT_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"symbols": self.symbols, "trade_fees": self.trade_fees}, f)
+        os.replace(path + ".tmp", path)
+
+    def get_symbol_info(self, symbol: str) -> Optional[Dict[str, Any]]:
+        return self.symbols.get(symbol)
+
+    def get_trade_fee(self, symbol: str) -> Optional[float]:
+        return self.trade_fees.get(symbol)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Save the exchange information and trade fees for offline backtests")
+    parser.add_argument("--path", default=EXCHANGE_SNAPSHOT_PATH, help="File to save the snapshot to")
+    args = parser.parse_args()
+
+    config = Config()
+    client = Client(config.BINANCE_API_KEY, config.BINANCE_API_SECRET_KEY, tld=config.BINANCE_TLD)
+    ExchangeSnapshot.download(client).save(args.path)
@@ -0,0 +1,123 @@
+import argparse
+import csv
+import io
+import os
+import re
+import zipfile
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from .logger import Logger
+from .price_store import PRICE_STORE_PATH, PriceStore, from_minute
+
+# Names of the files published on https://data.binance.vision, e.g. BTCUSDT-1m-2021-01.zip or BTCUSDT-1m-2021-01-01.csv
+KLINE_FILE_PATTERN = re.compile(r"^(?P<symbol>[A-Z0-9]+)-1m-\d{4}-\d{2}(-\d{2})?\.(zip|csv)$")
+
+
+def find_kline_files(directory: str) -> Dict[str, List[str]]:
+    """
+    Find all the 1m kline files in a directory tree, grouped by symbol
+    """
+    files: Dict[str, List[str]] = {}
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            match = KLINE_FILE_PATTERN.match(filename)
+            if match:
+                files.setdefault(match.group("symbol"), []).append(os.path.join(dirpath, filename))
+    return {symbol: sorted(paths) for symbol, paths in sorted(files.items())}
+
+
+def _open_rows(path: str) -> Iterator[List[str]]:
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                with archive.open(name) as f:
+                    yield from csv.reader(io.TextIOWrapper(f, newline=""))
+    else:
+        with open(path, newline="") as f:
+            yield from csv.reader(f)
+
+
+def read_kline_file(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read the open minute and open price of every kline of a file
+    """
+    times = []
+    prices = []
+    for row in _open_rows(path):
+        # Some files start with a header row
+        if not row or not row[0].isdigit():
+            continue
+        times.append(int(row[0]))
+        prices.append(float(row[1]))
+    times = np.array(times, dtype=np.int64)
+    # Open times are in milliseconds, except in newer files where they are in microseconds
+    minutes = np.where(times >= 10**15, times // 60000000, times // 60000)
+    return minutes, np.array(prices)
+
+
+def find_gaps(store: PriceStore, symbol: str, start: int, end: int) -> List[Tuple[int, int]]:
+    """
+    Find the ranges of minutes without a price between start and end
+    """
+    missing = np.isnan(store.get_range(symbol, start, end)).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], missing, [0])))
+    gap_starts = np.flatnonzero(edges == 1)
+    gap_ends = np.flatnonzero(edges == -1)
+    return [(start + int(gap_start), start + int(gap_end)) for gap_start, gap_end in zip(gap_starts, gap_ends)]
+
+
+def import_klines(directory: str, store: PriceStore, logger: Logger) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Load every 1m kline file found in a directory into the price store, and report the gaps in the data
+
+    :return: The gaps of each imported symbol, as ranges of minutes
+    """
+    files = find_kline_files(directory)
+    logger.info(f"Importing {sum(len(paths) for paths in files.values())} kline files for {len(files)} symbols")
+
+    all_gaps = {}
+    for symbol, paths in files.items():
+        first, last, count = None, None, 0
+        for path in paths:
+            minutes, prices = read_kline_file(path)
+            if len(minutes) == 0:
+                continue
+            start = int(minutes.min())
+            end = int(minutes.max()) + 1
+            # Klines overlapping between files are deduplicated by writing them to the same minute, and
+            # minutes missing from this file keep the prices already imported from another one
+            values = store.get_range(symbol, start, end)
+            values[minutes - start] = prices
+            store.write(symbol, start, values)
+            first = start if first is None else min(first, start)
+            last = end if last is None else max(last, end)
+            count += len(minutes)
+        store.flush()
+
+        if first is None:
+            continue
+        gaps = find_gaps(store, symbol, first, last)
+        all_gaps[symbol] = gaps
+        logger.info(
+            f"Imported {count} klines of {symbol} between {from_minute(first)} and {from_minute(last)}, "
+            f"{sum(end - start for start, end in gaps)} minutes missing in {len(gaps)} gaps",
+            False,
+        )
+        for start, end in sorted(gaps, key=lambda gap: gap[0] - gap[1])[:5]:
+            logger.info(f"  {symbol} has no prices between {from_minute(start)} and {from_minute(end)}", False)
+    return all_gaps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import 1m kline files downloaded from https://data.binance.vision into the backtest cache"
+    )
+    parser.add_argument("directory", help="Directory containing the .zip or .csv kline files")
+    parser.add_argument("--store", default=PRICE_STORE_PATH, help="Price store directory")
+    args = parser.parse_args()
+
+    price_store = PriceStore(args.store)
+    import_klines(args.directory, price_store, Logger("kline_import", enable_notifications=False))
+    price_store.close()
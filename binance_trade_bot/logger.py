@@ -12,6 +12,10 @@ class Logger:
         self.Logger = logging.getLogger(f"{logging_service}_logger")
         self.Logger.setLevel(logging.DEBUG)
         self.Logger.propagate = False
+        # The same service can be set up more than once in a process, e.g. when running several backtests
+        for handler in list(self.Logger.handlers):
+            self.Logger.removeHandler(handler)
+            handler.close()
         formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
         # default is "logs/crypto_trading.log"
         fh = logging.FileHandler(f"logs/{logging_service}.log")
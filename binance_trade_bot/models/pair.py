@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Float, ForeignKey, Integer, String, func, or_, select
-from sqlalchemy.orm import column_property, relationship
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Index, Integer, String
+from sqlalchemy.orm import relationship
 
 from .base import Base
 from .coin import Coin
@@ -7,6 +7,11 @@ from .coin import Coin
 
 class Pair(Base):
     __tablename__ = "pairs"
+    __table_args__ = (
+        Index("ix_pairs_from_coin_id_to_coin_id", "from_coin_id", "to_coin_id", unique=True),
+        Index("ix_pairs_from_coin_id_enabled", "from_coin_id", "enabled"),
+        Index("ix_pairs_to_coin_id", "to_coin_id"),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -18,17 +23,14 @@ class Pair(Base):
 
     ratio = Column(Float)
 
-    enabled = column_property(
-        select([func.count(Coin.symbol) == 2])
-        .where(or_(Coin.symbol == from_coin_id, Coin.symbol == to_coin_id))
-        .where(Coin.enabled.is_(True))
-        .scalar_subquery()
-    )
+    # Whether both coins are enabled, kept up to date by Database.set_coins
+    enabled = Column(Boolean)
 
     def __init__(self, from_coin: Coin, to_coin: Coin, ratio=None):
         self.from_coin = from_coin
         self.to_coin = to_coin
         self.ratio = ratio
+        self.enabled = bool(from_coin.enabled and to_coin.enabled)
 
     def __repr__(self):
         return f"<{self.from_coin_id}->{self.to_coin_id} :: {self.ratio}>"
@@ -0,0 +1,40 @@
+from datetime import datetime as _datetime
+
+from sqlalchemy import Column, DateTime, Enum, Float, Index, Integer
+
+from .base import Base
+from .coin_value import Interval
+
+
+class PortfolioValue(Base):  # pylint: disable=too-few-public-methods
+    """
+    The total value of all the balances at the time of a value snapshot, so that the total value history
+    doesn't have to be summed from the value of each coin.
+
+    Like the coin values, the first snapshot of each hour, day and week is marked with that interval, and the
+    shorter intervals are only kept for a while.
+    """
+
+    __tablename__ = "portfolio_value"
+    __table_args__ = (
+        Index("ix_portfolio_value_datetime", "datetime"),
+        Index("ix_portfolio_value_interval_datetime", "interval", "datetime"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    btc_value = Column(Float)
+    usd_value = Column(Float)
+
+    interval = Column(Enum(Interval))
+
+    datetime = Column(DateTime)
+
+    def __init__(self, btc_value: float, usd_value: float, interval: Interval, datetime: _datetime):
+        self.btc_value = btc_value
+        self.usd_value = usd_value
+        self.interval = interval
+        self.datetime = datetime
+
+    def info(self):
+        return {"datetime": self.datetime.isoformat(), "btc": self.btc_value, "usd": self.usd_value}
@@ -0,0 +1,316 @@
+import bisect
+import calendar
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+PRICE_STORE_PATH = "data/backtest_prices"
+INDEX_FILE_NAME = "index.json"
+
+# Every symbol file starts at this minute, so the same offset addresses the same minute in all of them.
+# Minutes without a price are stored as 0, which lets untouched regions of the file stay sparse on disk.
+ORIGIN = datetime(2017, 7, 1)
+# Files are grown in blocks of this many minutes (~45 days) to avoid remapping them on every write
+GROW_STEP = 65536
+
+PRICE_DTYPE = np.dtype("<f8")
+
+# Candle sizes kept for each symbol, in minutes. The coarser ones are aggregated from the 1m prices.
+RESOLUTIONS = {"1m": 1, "5m": 5, "15m": 15, "1h": 60, "1d": 1440}
+
+
+def to_minute(date: datetime) -> int:
+    """
+    Convert a naive UTC datetime into a number of minutes since the unix epoch
+    """
+    return calendar.timegm(date.timetuple()) // 60
+
+
+def from_minute(minute: int) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(minutes=minute)
+
+
+ORIGIN_MINUTE = to_minute(ORIGIN)
+
+
+def _level_name(symbol: str, resolution: int) -> str:
+    return symbol if resolution == 1 else f"{symbol}.{resolution}m"
+
+
+class PriceStore:
+    """
+    Columnar storage of one price per minute for each symbol.
+
+    Each symbol is a flat float array on disk, memory-mapped and indexed by its minute offset from ORIGIN.
+    Next to it, one smaller array per coarser resolution holds the opening price of each candle.
+    A small JSON index records which minute ranges of each symbol have been stored.
+    """
+
+    def __init__(self, path: str = PRICE_STORE_PATH, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self._arrays: Dict[str, np.memmap] = {}
+        self._coverage: Optional[Dict[str, List[List[int]]]] = None
+        self._dirty = False
+        # Last forward-fill lookup of each array: the offset it was made at and the price found
+        self._fills: Dict[str, Tuple[int, Optional[float]]] = {}
+
+    @property
+    def coverage(self) -> Dict[str, List[List[int]]]:
+        if self._coverage is None:
+            index_path = os.path.join(self.path, INDEX_FILE_NAME)
+            if os.path.exists(index_path):
+                with open(index_path) as f:
+                    self._coverage = json.load(f)
+            else:
+                self._coverage = {}
+        return self._coverage
+
+    def _symbol_path(self, symbol: str):
+        return os.path.join(self.path, f"{symbol}.f8")
+
+    def _open(self, symbol: str, min_length: int = 0) -> Optional[np.memmap]:
+        array = self._arrays.get(symbol)
+        if array is not None and len(array) >= min_length:
+            return array
+
+        file_path = self._symbol_path(symbol)
+        size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        length = size // PRICE_DTYPE.itemsize
+
+        if length < min_length:
+            if self.read_only:
+                return None
+            if array is not None:
+                array.flush()
+                del self._arrays[symbol]
+            os.makedirs(self.path, exist_ok=True)
+            length = (min_length // GROW_STEP + 1) * GROW_STEP
+            with open(file_path, "ab") as f:
+                f.truncate(length * PRICE_DTYPE.itemsize)
+
+        if length == 0:
+            return None
+
+        array = np.memmap(file_path, dtype=PRICE_DTYPE, mode="r" if self.read_only else "r+", shape=(length,))
+        self._arrays[symbol] = array
+        return array
+
+    def _level(self, symbol: str, resolution: int, min_length: int = 0) -> Optional[np.memmap]:
+        """
+        Open the array of a symbol at the given resolution, indexed by bucket offset from ORIGIN
+        """
+        if resolution == 1:
+            return self._open(symbol, min_length)
+        name = _level_name(symbol, resolution)
+        if (
+            name not in self._arrays
+            and not self.read_only
+            and not os.path.exists(self._symbol_path(name))
+            and os.path.exists(self._symbol_path(symbol))
+        ):
+            # Stores written before this level existed get it built once from the whole 1m base
+            base = self._open(symbol)
+            self._aggregate(symbol, resolution, 0, -(-len(base) // resolution))
+        return self._open(name, min_length)
+
+    def _aggregate(self, symbol: str, resolution: int, first: int, last: int):
+        """
+        Rebuild the buckets [first, last) of a level from the 1m base: each bucket gets the first price in it
+        """
+        prices = self._read(symbol, 1, first * resolution, last * resolution).reshape(-1, resolution)
+        found = ~np.isnan(prices)
+        values = prices[np.arange(len(prices)), found.argmax(axis=1)]
+        array = self._open(_level_name(symbol, resolution), last)
+        array[first:last] = np.nan_to_num(values, nan=0.0)
+
+    def _read(self, symbol: str, resolution: int, first: int, last: int, stride: int = 1) -> np.ndarray:
+        """
+        Read every `stride` bucket offsets of [first, last) at the given resolution, with NaN for missing prices
+        """
+        result = np.full(len(range(first, last, stride)), np.nan)
+        array = self._level(symbol, resolution)
+        if array is None:
+            return result
+        start = max(first, 0)
+        start += (first - start) % stride
+        end = min(last, len(array))
+        if start >= end:
+            return result
+        values = np.array(array[start:end:stride])
+        values[values == 0] = np.nan
+        index = (start - first) // stride
+        result[index : index + len(values)] = values
+        return result
+
+    def get_price(self, symbol: str, minute: int, fill: bool = False, resolution: int = 1) -> Optional[float]:
+        """
+        Get the stored price of a symbol at a given minute, or None if it isn't stored.
+        With `fill`, the last price stored before a missing minute is returned instead.
+        With a `resolution` in minutes, the opening price of the candle containing the minute is returned.
+        """
+        array = self._arrays.get(_level_name(symbol, resolution))
+        if array is None:
+            array = self._level(symbol, resolution)
+            if array is None:
+                return None
+        offset = (minute - ORIGIN_MINUTE) // resolution
+        if 0 <= offset < len(array):
+            price = array[offset]
+            if price:
+                return float(price)
+        if fill:
+            return self._last_price(symbol, resolution, offset)
+        return None
+
+    def _last_price(self, symbol: str, resolution: int, offset: int) -> Optional[float]:
+        """
+        Get the last price of a symbol stored at or before the given bucket offset
+        """
+        array = self._level(symbol, resolution)
+        if array is None or offset < 0:
+            return None
+        offset = min(offset, len(array) - 1)
+
+        # Lookups mostly move forward in time, so only the buckets since the previous one have to be scanned
+        name = _level_name(symbol, resolution)
+        scanned, price = self._fills.get(name, (-1, None))
+        if scanned > offset:
+            scanned, price = -1, None
+        end = offset + 1
+        while end > scanned + 1:
+            start = max(scanned + 1, end - GROW_STEP)
+            prices = np.flatnonzero(array[start:end])
+            if len(prices):
+                price = float(array[start + prices[-1]])
+                break
+            end = start
+        self._fills[name] = (offset, price)
+        return price
+
+    def get_range(  # pylint: disable=too-many-arguments
+        self, symbol: str, start: int, end: int, step: int = 1, fill: bool = False, resolution: int = 1
+    ) -> np.ndarray:
+        """
+        Get the prices of a symbol for every `step` minutes of [start, end), with NaN where there is no price.
+        With `fill`, missing minutes get the last price stored before them instead, as long as there is one.
+        With a `resolution` in minutes, which `step` has to be a multiple of, candle opening prices are used.
+        """
+        if step % resolution:
+            raise ValueError(f"Step of {step} minutes is not a multiple of the {resolution} minutes resolution")
+        stride = step // resolution
+        count = len(range(start, end, step))
+        first = (start - ORIGIN_MINUTE) // resolution
+        if not fill:
+            return self._read(symbol, resolution, first, first + count * stride, stride)
+
+        values = self._read(symbol, resolution, first, first + max(0, (count - 1) * stride + 1))
+        if len(values) == 0:
+            return values
+        found = ~np.isnan(values)
+        last = np.maximum.accumulate(np.where(found, np.arange(len(values)), -1))
+        previous = self._last_price(symbol, resolution, first - 1)
+        values = np.where(last >= 0, values[last], np.nan if previous is None else previous)
+        return values[::stride]
+
+    def write(self, symbol: str, start: int, prices: np.ndarray):
+        """
+        Store consecutive minute prices of a symbol starting at the given minute. NaN marks a missing price.
+        The candles of the coarser resolutions that contain these minutes are updated too.
+        """
+        prices = np.nan_to_num(np.asarray(prices, dtype=PRICE_DTYPE), nan=0.0)
+        if start < ORIGIN_MINUTE:
+            prices = prices[ORIGIN_MINUTE - start :]
+            start = ORIGIN_MINUTE
+        if len(prices) == 0:
+            return
+        offset = start - ORIGIN_MINUTE
+        array = self._open(symbol, offset + len(prices))
+        array[offset : offset + len(prices)] = prices
+        for resolution in RESOLUTIONS.values():
+            self._fills.pop(_level_name(symbol, resolution), None)
+            if resolution > 1 and self._level(symbol, resolution) is not None:
+                self._aggregate(symbol, resolution, offset // resolution, -(-(offset + len(prices)) // resolution))
+        self.add_coverage(symbol, start, start + len(prices))
+
+    def build_levels(self, symbol: str):
+        """
+        Make sure every resolution of a symbol has been aggregated, e.g. before opening the store read-only
+        """
+        for resolution in RESOLUTIONS.values():
+            self._level(symbol, resolution)
+
+    def write_klines(self, symbol: str, klines: List[Tuple[int, float]]):
+        """
+        Store a batch of (open time in milliseconds, price) tuples of a symbol
+        """
+        if not klines:
+            return
+        minutes = np.fromiter((kline[0] // 60000 for kline in klines), dtype=np.int64, count=len(klines))
+        start = int(minutes.min())
+        prices = np.full(int(minutes.max()) - start + 1, np.nan)
+        prices[minutes - start] = [kline[1] for kline in klines]
+        self.write(symbol, start, prices)
+
+    def add_coverage(self, symbol: str, start: int, end: int):
+        """
+        Record that the minutes [start, end) of a symbol have been stored, including those without a price,
+        so that they aren't fetched again
+        """
+        ranges = self.coverage.setdefault(symbol, [])
+        i = bisect.bisect_left(ranges, [start, start])
+        if i > 0 and ranges[i - 1][1] >= start:
+            i -= 1
+        j = i
+        while j < len(ranges) and ranges[j][0] <= end:
+            start = min(start, ranges[j][0])
+            end = max(end, ranges[j][1])
+            j += 1
+        ranges[i:j] = [[start, end]]
+        self._dirty = True
+
+    def is_covered(self, symbol: str, minute: int) -> bool:
+        """
+        Whether the given minute of a symbol has already been stored or fetched, with or without a price
+        """
+        ranges = self.coverage.get(symbol, [])
+        i = bisect.bisect_right(ranges, [minute, float("inf")])
+        return i > 0 and ranges[i - 1][0] <= minute < ranges[i - 1][1]
+
+    def missing_ranges(self, symbol: str, start: int, end: int) -> List[Tuple[int, int]]:
+        """
+        Get the sub-ranges of [start, end) that haven't been stored for a symbol yet
+        """
+        missing = []
+        for covered_start, covered_end in self.coverage.get(symbol, []):
+            if covered_end <= start:
+                continue
+            if covered_start >= end:
+                break
+            if covered_start > start:
+                missing.append((start, covered_start))
+            start = max(start, covered_end)
+        if start < end:
+            missing.append((start, end))
+        return missing
+
+    def flush(self):
+        if self.read_only:
+            return
+        for array in self._arrays.values():
+            array.flush()
+        if self._dirty:
+            os.makedirs(self.path, exist_ok=True)
+            index_path = os.path.join(self.path, INDEX_FILE_NAME)
+            with open(index_path + ".tmp", "w") as f:
+                json.dump(self.coverage, f)
+            os.replace(index_path + ".tmp", index_path)
+            self._dirty = False
+
+    def close(self):
+        self.flush()
+        self._arrays.clear()
+        self._coverage = None
@@ -0,0 +1,162 @@
+import threading
+from traceback import format_exc
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from .database import Database
+from .logger import Logger
+from .models import Coin, Pair
+
+
+class RatioMatrix:
+    """
+    Keeps the ratio threshold of every pair in memory, as a coin-indexed NxN array.
+
+    While trading, the matrix is the source of truth for the thresholds: scouting reads them without querying
+    the database, and updates are made to whole rows or columns at once. Changed ratios are written back to
+    the pairs table later, either by calling flush() or by a background writer started with start_writer().
+    """
+
+    def __init__(self, db: Database, logger: Logger):
+        self.db = db
+        self.logger = logger
+
+        coins = db.get_coins(only_enabled=False)
+        self.symbols = [coin.symbol for coin in coins]
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.enabled = np.array([bool(coin.enabled) for coin in coins], dtype=bool)
+
+        # ratios[i, j] is the threshold of the pair from coin i to coin j, NaN while it isn't initialized
+        self.ratios = np.full((len(coins), len(coins)), np.nan)
+        self.has_pair = np.zeros((len(coins), len(coins)), dtype=bool)
+        self.pairs: Dict[Tuple[int, int], Pair] = {}
+        for pair in db.get_pairs(only_enabled=False):
+            key = (self.index[pair.from_coin_id], self.index[pair.to_coin_id])
+            self.pairs[key] = pair
+            self.has_pair[key] = True
+            if pair.ratio is not None:
+                self.ratios[key] = pair.ratio
+
+        # Incremented on every change, so that anything computed from the thresholds knows when it's stale
+        self.version = 0
+        self._dirty: Set[Tuple[int, int]] = set()
+        self._mutex = threading.Lock()
+        self._stop = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+
+    def _symbol(self, coin: Union[Coin, str]) -> str:
+        return coin.symbol if isinstance(coin, Coin) else coin
+
+    def get_ratio(self, pair: Pair) -> Optional[float]:
+        ratio = self.ratios[self.index[pair.from_coin_id], self.index[pair.to_coin_id]]
+        return None if np.isnan(ratio) else float(ratio)
+
+    def get_block(self, symbols: List[str]) -> np.ndarray:
+        """
+        Get a copy of the thresholds between the given coins, in the same order
+        """
+        indexes = [self.index[symbol] for symbol in symbols]
+        return self.ratios[np.ix_(indexes, indexes)].copy()
+
+    def get_pair(self, from_coin: Union[Coin, str], to_coin: Union[Coin, str], only_enabled=True) -> Optional[Pair]:
+        i = self.index.get(self._symbol(from_coin))
+        j = self.index.get(self._symbol(to_coin))
+        if i is None or j is None or (only_enabled and not (self.enabled[i] and self.enabled[j])):
+            return None
+        return self.pairs.get((i, j))
+
+    def pairs_from(self, coin: Union[Coin, str], only_enabled=True) -> List[Pair]:
+        i = self.index[self._symbol(coin)]
+        return [
+            self.pairs[(i, j)]
+            for j in np.flatnonzero(self.has_pair[i])
+            if not only_enabled or (self.enabled[i] and self.enabled[j])
+        ]
+
+    def pairs_to(self, coin: Union[Coin, str], only_enabled=True) -> List[Pair]:
+        j = self.index[self._symbol(coin)]
+        return [
+            self.pairs[(i, j)]
+            for i in np.flatnonzero(self.has_pair[:, j])
+            if not only_enabled or (self.enabled[i] and self.enabled[j])
+        ]
+
+    def _set(self, mask: np.ndarray, values: np.ndarray):
+        with self._mutex:
+            self.version += 1
+            self.ratios[mask] = values[mask]
+            for key in zip(*np.nonzero(mask)):
+                key = (int(key[0]), int(key[1]))
+                # The cached pairs are handed out to the rest of the bot, so they are kept up to date too
+                self.pairs[key].ratio = float(self.ratios[key])
+                self._dirty.add(key)
+
+    def set_column(self, coin: Union[Coin, str], ratios: np.ndarray):
+        """
+        Set the thresholds of all the pairs to a coin at once. NaN leaves a threshold unchanged.
+
+        :param ratios: The new threshold from each coin, in the order of `symbols`
+        """
+        j = self.index[self._symbol(coin)]
+        mask = np.zeros_like(self.has_pair)
+        mask[:, j] = self.has_pair[:, j] & ~np.isnan(ratios)
+        values = np.zeros_like(self.ratios)
+        values[:, j] = ratios
+        self._set(mask, values)
+
+    def initialize(self, prices: np.ndarray) -> List[Tuple[str, str]]:
+        """
+        Set the threshold of every pair between enabled coins that doesn't have one yet, from the coin prices
+
+        :param prices: The bridge price of each coin in the order of `symbols`, NaN when it isn't known
+        :return: The (from, to) symbols of the pairs that were initialized
+        """
+        known = self.enabled & ~np.isnan(prices)
+        mask = self.has_pair & np.isnan(self.ratios) & known[:, None] & known[None, :]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = prices[:, None] / prices[None, :]
+        self._set(mask, values)
+        return [(self.symbols[i], self.symbols[j]) for i, j in zip(*np.nonzero(mask))]
+
+    def flush(self):
+        """
+        Write the thresholds changed since the last flush to the pairs table
+        """
+        with self._mutex:
+            keys = list(self._dirty)
+            self._dirty.clear()
+        if not keys:
+            return
+        try:
+            self.db.update_pair_ratios([self.pairs[key] for key in keys])
+        except Exception:
+            # Keep the changes so that the next flush writes them
+            with self._mutex:
+                self._dirty.update(keys)
+            raise
+
+    def _write_behind(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                self.logger.warning(format_exc())
+
+    def start_writer(self, interval: float = 5):
+        """
+        Flush the changed thresholds from a background thread every `interval` seconds
+        """
+        self._stop.clear()
+        self._writer = threading.Thread(target=self._write_behind, args=(interval,), daemon=True)
+        self._writer.start()
+
+    def close(self):
+        """
+        Stop the background writer, if any, and write the last changes
+        """
+        if self._writer is not None:
+            self._stop.set()
+            self._writer.join()
+            self._writer = None
+        self.flush()
@@ -9,12 +9,15 @@ class Strategy(AutoTrader):
     def initialize(self):
         super().initialize()
         self.initialize_current_coin()
+        # Coin of the last full scout, the coins it can jump to have all been evaluated since
+        self.scouted_coin = None
 
     def scout(self):
         """
         Scout for potential jumps from the current coin to another coin
         """
         current_coin = self.db.get_current_coin()
+        self.scouted_coin = current_coin.symbol
         # Display on the console, the current coin+Bridge, so users can see *some* activity and not think the bot has
         # stopped. Not logging though to reduce log size.
         print(
@@ -31,6 +34,25 @@ class Strategy(AutoTrader):
 
         self._jump_to_best_coin(current_coin, current_coin_price)
 
+    def scout_changes(self, ticker_symbols):
+        current_coin = self.db.get_current_coin()
+        if current_coin.symbol != self.scouted_coin or current_coin + self.config.BRIDGE in ticker_symbols:
+            # Every ratio from the current coin moved, or hasn't been evaluated yet
+            self.scout()
+            return
+
+        # Otherwise only the jumps to the coins whose price moved can have become worth it
+        bridge = self.config.BRIDGE.symbol
+        to_symbols = {symbol[: -len(bridge)] for symbol in ticker_symbols if symbol.endswith(bridge)}
+        if not to_symbols:
+            return
+
+        current_coin_price = self.manager.get_ticker_price(current_coin + self.config.BRIDGE)
+        if current_coin_price is None:
+            return
+
+        self._jump_to_best_coin(current_coin, current_coin_price, to_symbols)
+
     def bridge_scout(self):
         current_coin = self.db.get_current_coin()
         if self.manager.get_currency_balance(current_coin.symbol) > self.manager.get_min_notional(
@@ -1,12 +1,14 @@
 from datetime import datetime
 
+import numpy as np
+
 from binance_trade_bot.auto_trader import AutoTrader
 
 
 class Strategy(AutoTrader):
     def scout(self):
         """
-        Scout for potential jumps from the current coin to another coin
+        Scout for potential jumps from every coin we have to another coin
         """
         have_coin = False
 
@@ -17,30 +19,57 @@ class Strategy(AutoTrader):
         if current_coin is not None:
             current_coin_symbol = current_coin.symbol
 
-        for coin in self.db.get_coins():
-            current_coin_balance = self.manager.get_currency_balance(coin.symbol)
-            coin_price = self.manager.get_ticker_price(coin + self.config.BRIDGE)
+        # The jumps from all the coins we have are scored at once from a snapshot of the prices and balances,
+        # which is taken again for the coins left after a jump
+        remaining = list(np.flatnonzero(self.ratios.enabled))
+        while remaining:
+            prices = self._get_prices()
+            held = self._get_held_coins(remaining, prices, current_coin_symbol)
+            if not held:
+                break
+            have_coin = True
 
-            if coin_price is None:
-                self.logger.info(f"Skipping scouting... current coin {coin + self.config.BRIDGE} not found")
-                continue
+            scores = self._score_all_jumps(np.array(held), prices)
+            remaining = []
+            for row, i in enumerate(held):
+                coin = self.db.get_coin(self.ratios.symbols[i])
+                # Display on the console, the current coin+Bridge, so users can see *some* activity and not think
+                # the bot has stopped. Not logging though to reduce log size.
+                print(
+                    f"{datetime.now()} - CONSOLE - INFO - I am scouting the best trades. "
+                    f"Current coin: {coin + self.config.BRIDGE} ",
+                    end="\r",
+                )
 
-            min_notional = self.manager.get_min_notional(coin.symbol, self.config.BRIDGE.symbol)
+                self._log_scouts(i, prices)
+                best = self._best_jump(i, scores[row])
+                if best is not None and best[1] > 0:
+                    self.logger.info(f"Will be jumping from {coin} to {best[0].to_coin_id}")
+                    self.transaction_through_bridge(best[0])
+                    remaining = [j for j in np.flatnonzero(self.ratios.enabled) if j > i]
+                    break
 
-            if coin.symbol != current_coin_symbol and coin_price * current_coin_balance < min_notional:
-                continue
+        if not have_coin:
+            self.bridge_scout()
 
-            have_coin = True
+    def _get_held_coins(self, indexes, prices: np.ndarray, current_coin_symbol: str):
+        """
+        Get the coins among the given ones that we have enough of to trade, and the current coin
+        """
+        bridge = self.config.BRIDGE.symbol
+        balances = self.manager.get_currency_balances([self.ratios.symbols[i] for i in indexes])
 
-            # Display on the console, the current coin+Bridge, so users can see *some* activity and not think the bot
-            # has stopped. Not logging though to reduce log size.
-            print(
-                f"{datetime.now()} - CONSOLE - INFO - I am scouting the best trades. "
-                f"Current coin: {coin + self.config.BRIDGE} ",
-                end="\r",
-            )
+        held = []
+        for i in indexes:
+            symbol = self.ratios.symbols[i]
+            if np.isnan(prices[i]):
+                self.logger.info(f"Skipping scouting... current coin {symbol + bridge} not found")
+                continue
 
-            self._jump_to_best_coin(coin, coin_price)
+            if symbol != current_coin_symbol and (
+                not balances[symbol] or prices[i] * balances[symbol] < self.manager.get_min_notional(symbol, bridge)
+            ):
+                continue
 
-        if not have_coin:
-            self.bridge_scout()
+            held.append(i)
+        return held
@@ -0,0 +1,124 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import product
+from typing import Any, Dict, List
+
+from binance.client import Client
+
+from .backtest import backtest, cache, get_backtest_symbols, prefetch_prices
+from .config import Config
+from .exchange_snapshot import ExchangeSnapshot
+from .logger import Logger
+from .price_store import RESOLUTIONS, PriceStore, to_minute
+
+# Grid keys that are passed to backtest() instead of being set on the Config
+BACKTEST_PARAMETERS = {"interval", "vectorized", "fill_gaps", "resolution"}
+
+
+def _run_backtest(
+    params: Dict[str, Any],
+    start_date: datetime,
+    end_date: datetime,
+    start_balances: Dict[str, float],
+    yield_interval: int,
+    store_path: str,
+    snapshot: ExchangeSnapshot,
+):
+    config = Config(**{name: value for name, value in params.items() if name not in BACKTEST_PARAMETERS})
+    backtest_args = {name: value for name, value in params.items() if name in BACKTEST_PARAMETERS}
+
+    times, btc_values, bridge_values = [], [], []
+
+    def sample(manager):
+        times.append(manager.datetime)
+        btc_values.append(manager.collate_coins("BTC"))
+        bridge_values.append(manager.collate_coins(config.BRIDGE.symbol))
+
+    manager = None
+    for manager in backtest(
+        start_date,
+        end_date,
+        yield_interval=yield_interval,
+        start_balances=dict(start_balances) if start_balances else None,
+        config=config,
+        prefetch=False,
+        store=PriceStore(store_path, read_only=True),
+        snapshot=snapshot,
+        **backtest_args,
+    ):
+        # The last step moves the manager to the end of the backtest or past it, where no prices were fetched
+        if manager.datetime < end_date:
+            sample(manager)
+
+    # The final values are those of the last minute that was scouted, once it was scouted
+    step = backtest_args.get("interval", 1) * RESOLUTIONS.get(backtest_args.get("resolution", "1m"), 1)
+    if times and manager.datetime >= end_date and manager.datetime > times[0]:
+        manager.increment(-step)
+        if times[-1] == manager.datetime:
+            del times[-1], btc_values[-1], bridge_values[-1]
+    sample(manager)
+
+    return {
+        **params,
+        "balances": manager.balances,
+        "btc_value": btc_values[-1],
+        "bridge_value": bridge_values[-1],
+        "trades": manager.trade_count,
+        "times": times,
+        "btc_values": btc_values,
+        "bridge_values": bridge_values,
+    }
+
+
+def sweep(  # pylint: disable=too-many-arguments
+    grid: Dict[str, List[Any]],
+    start_date: datetime,
+    end_date: datetime = None,
+    start_balances: Dict[str, float] = None,
+    yield_interval=1440,
+    max_workers: int = None,
+    snapshot: ExchangeSnapshot = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run a backtest for every combination of the parameter grid, in parallel processes.
+
+    :param grid: Lists of values to try for each parameter. Keys are Config attribute names
+        (e.g. SCOUT_MULTIPLIER, USE_MARGIN, SUPPORTED_COIN_LIST)
+        or backtest() arguments (interval, vectorized, fill_gaps, resolution)
+    :param start_date: Date to backtest from
+    :param end_date: Date to backtest up to
+    :param start_balances: A dictionary of initial coin values. Default: {BRIDGE: 100}
+    :param yield_interval: How many intervals apart the value curves are sampled
+    :param max_workers: Number of backtests run at once. Default: number of CPUs
+    :param snapshot: Exchange information and trade fees to run the backtests with, without calling the API.
+        The prices then have to be in the store already
+
+    :return: One row per combination, with its parameters, final balances and values, trade count and value curves
+    """
+    end_date = end_date or datetime.today()
+    logger = Logger("backtesting", enable_notifications=False)
+    combinations = [dict(zip(grid, values)) for values in product(*grid.values())]
+
+    symbols = set()
+    for params in combinations:
+        config = Config(**{name: value for name, value in params.items() if name not in BACKTEST_PARAMETERS})
+        symbols.update(get_backtest_symbols(config, start_balances or {config.BRIDGE.symbol: 100}))
+
+    # Download every price once up front, so that the workers only have to read the store
+    if snapshot is None:
+        base_config = Config()
+        client = Client(base_config.BINANCE_API_KEY, base_config.BINANCE_API_SECRET_KEY, tld=base_config.BINANCE_TLD)
+        prefetch_prices(client, cache, logger, sorted(symbols), to_minute(start_date), to_minute(end_date))
+    for symbol in symbols:
+        cache.build_levels(symbol)
+    cache.close()
+
+    logger.info(f"Running {len(combinations)} backtests")
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = [
+            executor.submit(
+                _run_backtest, params, start_date, end_date, start_balances, yield_interval, cache.path, snapshot
+            )
+            for params in combinations
+        ]
+        return [future.result() for future in futures]
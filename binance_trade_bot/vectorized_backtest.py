@@ -0,0 +1,173 @@
+import math
+from datetime import datetime, timedelta
+from traceback import format_exc
+
+import numpy as np
+
+from .auto_trader import AutoTrader, get_jump_score
+from .config import Config
+from .database import Database
+from .logger import Logger
+from .price_store import PriceStore
+
+# Number of steps of prices loaded from the price store at once
+BLOCK_STEPS = 10000
+
+
+class VectorizedBacktest:
+    """
+    Runs the default strategy's scouting over a whole block of prices at once.
+
+    The bridge prices of all the enabled coins are loaded as a (time x coins) matrix and the jump scores
+    from the current coin are computed for many steps with array operations. Python only takes over when
+    a score turns positive, to make the same trade the default strategy would and rebase the thresholds.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        trader: AutoTrader,
+        manager,
+        db: Database,
+        logger: Logger,
+        config: Config,
+        store: PriceStore,
+        interval: int,
+        fill_gaps: bool = False,
+        resolution: int = 1,
+    ):
+        self.trader = trader
+        self.manager = manager
+        self.db = db
+        self.logger = logger
+        self.config = config
+        self.store = store
+        self.interval = interval
+        self.fill_gaps = fill_gaps
+        self.resolution = resolution
+
+        self.coins = db.get_coins()
+        self.symbols = [coin.symbol for coin in self.coins]
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+        self.from_fees = np.array([manager.get_fee(coin, config.BRIDGE, True) for coin in self.coins])
+        self.to_fees = np.array([manager.get_fee(coin, config.BRIDGE, False) for coin in self.coins])
+
+        # ratios[i, j] is the threshold of the pair from coin i to coin j
+        self.ratios = np.full((len(self.coins), len(self.coins)), np.nan)
+        self.current = None
+        self.sync()
+
+        self.start_minute = manager.minute
+        self._block_start = 0
+        self._block = np.empty((0, len(self.coins)))
+
+    def sync(self):
+        """
+        Reload the current coin from the database and the thresholds from the trader, after a scout that may have
+        changed them
+        """
+        current = self.index[self.db.get_current_coin().symbol]
+        if current == self.current:
+            return
+        self.current = current
+        self.ratios = self.trader.ratios.get_block(self.symbols)
+
+    def count_steps(self, end_date: datetime) -> int:
+        """
+        Number of scouts the backtest loop runs before reaching end_date
+        """
+        return max(0, math.ceil((end_date - self.manager.datetime) / timedelta(minutes=self.interval)))
+
+    def idle_steps(self, step: int, end: int) -> int:
+        """
+        Number of steps from `step` (up to `end`) during which no jump can fire from the current coin
+        """
+        row, _ = self._find_jump(self.current, self._get_prices(step, end))
+        return end - step if row is None else row
+
+    def _get_prices(self, start: int, end: int) -> np.ndarray:
+        """
+        Get the bridge prices of all the coins for the steps [start, end)
+        """
+        if start < self._block_start or end > self._block_start + len(self._block):
+            block_end = max(end, start + BLOCK_STEPS)
+            first_minute = self.start_minute + start * self.interval
+            last_minute = self.start_minute + block_end * self.interval
+            self._block = np.column_stack(
+                [
+                    self.store.get_range(
+                        symbol + self.config.BRIDGE.symbol,
+                        first_minute,
+                        last_minute,
+                        self.interval,
+                        self.fill_gaps,
+                        self.resolution,
+                    )
+                    for symbol in self.symbols
+                ]
+            )
+            self._block_start = start
+        return self._block[start - self._block_start : end - self._block_start]
+
+    def _find_jump(self, current: int, prices: np.ndarray):
+        """
+        Find the first row of prices where jumping from the current coin is worth it, and the coin to jump to
+        """
+        coin_prices = prices[:, current : current + 1]
+        ratios = self.ratios[current]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores = get_jump_score(self.config, coin_prices, prices, ratios, self.from_fees[current], self.to_fees)
+        scores[:, current] = np.nan
+
+        # A scout is skipped when the current coin has no price, and fails when an optional coin
+        # with a price has no threshold yet
+        candidates = ~np.isnan(prices)
+        candidates[:, current] = False
+        valid = ~np.isnan(coin_prices[:, 0]) & ~(candidates & np.isnan(ratios)).any(axis=1)
+
+        positive = scores > 0
+        jumps = np.flatnonzero(positive.any(axis=1) & valid)
+        if len(jumps) == 0:
+            return None, None
+        row = jumps[0]
+        return int(row), int(np.argmax(np.where(positive[row], scores[row], -np.inf)))
+
+    def _jump(self, current: int, target: int, prices: np.ndarray) -> int:
+        pair = next(
+            pair for pair in self.db.get_pairs_from(self.symbols[current]) if pair.to_coin_id == self.symbols[target]
+        )
+        self.logger.info(f"Will be jumping from {pair.from_coin} to {pair.to_coin_id}")
+        try:
+            result = self.trader.transaction_through_bridge(pair)
+        except Exception:  # pylint: disable=broad-except
+            self.logger.warning(format_exc())
+            result = None
+
+        if result is not None:
+            # Same rebase as AutoTrader.update_trade_threshold, using the price the coin was bought at
+            self.ratios[:, target] = np.where(np.isnan(prices), self.ratios[:, target], prices / result.price)
+        return self.index[self.db.get_current_coin().symbol]
+
+    def run(self, end_date: datetime, yield_interval: int):
+        """
+        Step through [manager.datetime, end_date) like the backtest loop, yielding the manager every
+        yield_interval steps
+        """
+        steps = self.count_steps(end_date)
+
+        step = 0
+        while step < steps:
+            segment_end = min(steps, (step // yield_interval + 1) * yield_interval)
+            while step < segment_end:
+                row, target = self._find_jump(self.current, self._get_prices(step, segment_end))
+                if row is None:
+                    break
+                self.manager.increment(row * self.interval)
+                step += row
+                self.current = self._jump(self.current, target, self._get_prices(step, step + 1)[0])
+                self.manager.increment(self.interval)
+                step += 1
+            self.manager.increment((segment_end - step) * self.interval)
+            step = segment_end
+            if step % yield_interval == 0:
+                yield self.manager
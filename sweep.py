@@ -0,0 +1,15 @@
+from datetime import datetime
+
+from binance_trade_bot import sweep
+
+if __name__ == "__main__":
+    grid = {
+        "SCOUT_MULTIPLIER": [3, 5, 7],
+        "USE_MARGIN": ["no"],
+        "interval": [1, 5],
+    }
+    results = sweep(grid, datetime(2021, 1, 1), datetime(2021, 2, 1))
+    columns = list(grid) + ["btc_value", "bridge_value", "trades"]
+    print(" | ".join(f"{column:>16}" for column in columns))
+    for row in sorted(results, key=lambda result: result["bridge_value"], reverse=True):
+        print(" | ".join(f"{row[column]:>16}" for column in columns))
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from binance_trade_bot.config import Config
+from binance_trade_bot.database import Database
+from binance_trade_bot.exchange_snapshot import ExchangeSnapshot
+from binance_trade_bot.logger import Logger
+from binance_trade_bot.price_store import PriceStore, to_minute
+
+COINS = ["AAA", "BBB", "CCC"]
+START_DATE = datetime(2021, 1, 1)
+END_DATE = START_DATE + timedelta(days=2)
+
+
+@pytest.fixture(autouse=True)
+def _workdir(tmp_path, monkeypatch):
+    # The config and loggers read and write files relative to the working directory
+    (tmp_path / "logs").mkdir()
+    (tmp_path / "user.cfg").write_text("[binance_user_config]\napi_key=\napi_secret_key=\ncurrent_coin=\n")
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def price_store(tmp_path) -> PriceStore:
+    """
+    A price store with random walk prices of the coins against USDT and BTC, for the minutes
+    [START_DATE, END_DATE) only, like the prices a sweep prefetches
+    """
+    rng = np.random.default_rng(0)
+    minutes = to_minute(END_DATE) - to_minute(START_DATE)
+
+    def random_walk(start_price):
+        return start_price * np.exp(np.cumsum(rng.normal(0, 0.002, minutes)))
+
+    store = PriceStore(str(tmp_path / "prices"))
+    btc_prices = random_walk(30000)
+    store.write("BTCUSDT", to_minute(START_DATE), btc_prices)
+    for coin in COINS:
+        usdt_prices = random_walk(10)
+        store.write(coin + "USDT", to_minute(START_DATE), usdt_prices)
+        store.write(coin + "BTC", to_minute(START_DATE), usdt_prices / btc_prices)
+    store.flush()
+    return store
+
+
+@pytest.fixture
+def snapshot() -> ExchangeSnapshot:
+    filters = [
+        {"filterType": "LOT_SIZE", "stepSize": "0.00100000"},
+        {"filterType": "NOTIONAL", "minNotional": "10.0"},
+    ]
+    symbols = {coin + "USDT": {"symbol": coin + "USDT", "filters": filters} for coin in COINS}
+    return ExchangeSnapshot(symbols, {symbol: 0.00075 for symbol in symbols})
+
+
+@pytest.fixture
+def database(tmp_path) -> Database:
+    """
+    A bot database with the test coins, which doesn't try to reach the API server
+    """
+    db = Database(Logger("database", enable_notifications=False), Config(), f"sqlite:///{tmp_path / 'bot.db'}")
+    db.socketio_connect = lambda: False
+    db.create_database()
+    db.set_coins(COINS)
+    yield db
+    db.stop_writer()
@@ -0,0 +1,45 @@
+import importlib
+from datetime import datetime, timedelta
+
+import pytest
+
+from binance_trade_bot.database import Database
+from binance_trade_bot.models import CoinValue
+
+from .conftest import COINS
+
+
+@pytest.fixture
+def api_client(tmp_path, database):
+    api_server = importlib.import_module("binance_trade_bot.api_server")
+    read_only_db = Database(
+        api_server.logger, api_server.config, f"sqlite:///{tmp_path / 'bot.db'}", cache=False, read_only=True
+    )
+    original_db, api_server.db = api_server.db, read_only_db
+    yield api_server.app.test_client()
+    api_server.db = original_db
+
+
+def log_value_history(database: Database, days: int):
+    """
+    Log a snapshot of the value of a coin every 10 minutes for the last days, away from the hour boundaries
+    """
+    now = datetime.now()
+    coin = database.get_coin(COINS[0])
+    database.log_values(
+        [CoinValue(coin, 1, 1, 1, datetime=now - timedelta(minutes=5 + 10 * i)) for i in reversed(range(days * 24 * 6))]
+    )
+
+
+def test_total_value_history_of_a_day_is_minutely(database, api_client):
+    log_value_history(database, 3)
+    total_values = api_client.get("/api/total_value_history?period=1d").get_json()
+    # Every snapshot of the last day
+    assert len(total_values) == 24 * 6
+
+
+def test_total_value_history_of_a_week_is_hourly(database, api_client):
+    log_value_history(database, 10)
+    total_values = api_client.get("/api/total_value_history?period=1w").get_json()
+    # The first snapshot of each hour of the last week
+    assert 7 * 24 <= len(total_values) <= 7 * 24 + 1
@@ -0,0 +1,62 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from binance_trade_bot.backtest import MockBinanceManager, MockDatabase, backtest
+from binance_trade_bot.config import Config
+from binance_trade_bot.logger import Logger
+from binance_trade_bot.price_store import PriceStore, to_minute
+
+from .conftest import COINS, END_DATE, START_DATE
+
+
+def value_history(price_store, snapshot, config, **kwargs):
+    return [
+        (manager.datetime, dict(manager.balances), manager.collate_coins("BTC"), manager.trade_count)
+        for manager in backtest(
+            START_DATE, END_DATE, yield_interval=97, config=config, store=price_store, snapshot=snapshot, **kwargs
+        )
+    ]
+
+
+@pytest.mark.parametrize("use_margin", ["no", "yes"])
+@pytest.mark.parametrize("scout_multiplier", [1, 5])
+@pytest.mark.parametrize("mode", ["vectorized", "skip_idle"])
+def test_fast_backtest_matches_backtest(price_store, snapshot, mode, use_margin, scout_multiplier):
+    config = Config(SUPPORTED_COIN_LIST=COINS, USE_MARGIN=use_margin, SCOUT_MULTIPLIER=scout_multiplier)
+    expected = value_history(price_store, snapshot, config)
+    actual = value_history(price_store, snapshot, config, **{mode: True})
+
+    # The coins have to be traded for the comparison to mean anything
+    assert expected[-1][3] > 0
+    assert actual == expected
+
+
+class NoKlinesClient:
+    def get_historical_klines(self, *args, **kwargs):
+        return []
+
+
+def test_fetched_prices_stop_at_the_current_utc_minute(tmp_path):
+    # Local time is ahead of UTC here, so it can't be used to know which minutes are in the future
+    local_timezone = os.environ.get("TZ")
+    os.environ["TZ"] = "Asia/Tokyo"
+    time.tzset()
+    try:
+        config = Config(SUPPORTED_COIN_LIST=COINS)
+        logger = Logger("backtesting", enable_notifications=False)
+        store = PriceStore(str(tmp_path / "prices"))
+        start_date = datetime.utcnow() - timedelta(minutes=10)
+        manager = MockBinanceManager(config, MockDatabase(logger, config), logger, start_date, store=store)
+        manager._binance_client = NoKlinesClient()  # pylint: disable=protected-access
+
+        assert manager.get_ticker_price("AAAUSDT") is None
+        assert not store.is_covered("AAAUSDT", to_minute(datetime.utcnow()) + 1)
+    finally:
+        if local_timezone is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = local_timezone
+        time.tzset()
@@ -0,0 +1,24 @@
+import time
+
+from binance_trade_bot.binance_stream_manager import BinanceCache
+
+
+def test_only_watched_tickers_wake_up_scouting():
+    cache = BinanceCache()
+    cache.watch_tickers({"AAAUSDT"})
+    try:
+        cache.wait_for_ticker_updates(0)
+        # Unique prices, so that every update is a change
+        price = time.time()
+
+        cache.update_ticker_values({"XYZBTC": price})
+        assert cache.wait_for_ticker_updates(0) == set()
+        assert cache.ticker_values["XYZBTC"] == price
+
+        cache.update_ticker_values({"XYZBTC": price + 1, "AAAUSDT": price})
+        assert cache.wait_for_ticker_updates(0) == {"AAAUSDT"}
+        # Scouting still finds out about the other changes, e.g. to rescore the jumps
+        changed, _ = cache.get_ticker_changes(0)
+        assert {"XYZBTC", "AAAUSDT"} <= changed
+    finally:
+        cache.watch_tickers(None)
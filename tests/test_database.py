@@ -0,0 +1,137 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, func
+
+from binance_trade_bot.database import Database
+from binance_trade_bot.models import Base, CoinValue, Interval, Pair, Trade, TradeState
+
+from .conftest import COINS
+
+
+def block_writer(db: Database) -> threading.Event:
+    """
+    Keep the writer busy until the returned event is set, so that the writes queued meanwhile are made together
+    """
+    started, release = threading.Event(), threading.Event()
+
+    def wait(_):
+        started.set()
+        release.wait()
+
+    db.write(wait)
+    started.wait()
+    return release
+
+
+def test_value_history_is_marked_again_after_a_rolled_back_prune(database):
+    hour = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+    coin = database.get_coin(COINS[0])
+    database.log_values(
+        [CoinValue(coin, 1, 1, 1, datetime=hour + timedelta(minutes=minutes)) for minutes in (0, 10, 60, 70)]
+    )
+
+    database.start_writer()
+    release = block_writer(database)
+    database.prune_value_history()
+    failing = database.write(lambda session: session.execute("SELECT * FROM missing_table"))
+    release.set()
+    assert failing.exception(timeout=10) is not None
+    database.stop_writer()
+
+    with database.db_session() as session:
+        intervals = [cv.interval for cv in session.query(CoinValue).order_by(CoinValue.datetime)]
+    # The first entry of each hour is kept as at least hourly
+    assert [interval == Interval.MINUTELY for interval in intervals] == [False, True, False, True]
+    assert database._value_history_high_water == 4  # pylint: disable=protected-access
+
+
+def test_scout_history_is_sent_once_committed(database):
+    sent = []
+
+    def socketio_connect():
+        # Everything that is sent must already be readable by the API server
+        sent.append(len(database.get_scout_history(COINS[0])))
+        return False
+
+    database.socketio_connect = socketio_connect
+    database.start_writer()
+    release = block_writer(database)
+    for _ in range(3):
+        database.log_scout(database.get_pair(COINS[0], COINS[1]), 1, 1, 1)
+    release.set()
+    database.stop_writer()
+
+    # One attempt to reach the API server for the whole batch
+    assert sent == [3]
+
+
+def test_updates_are_sent_once_committed(database):
+    sent = []
+
+    class SocketIOClient:  # pylint: disable=too-few-public-methods
+        def emit(self, _, update, namespace):  # pylint: disable=unused-argument
+            # Everything that is sent must already be readable by the API server
+            with database.db_session() as session:
+                table = Base.metadata.tables[update["table"]]
+                sent.append((update["table"], session.query(func.count()).select_from(table).scalar()))
+
+    database.socketio_connect = lambda: True
+    database.socketio_client = SocketIOClient()
+    database.start_writer()
+    database.set_current_coin(COINS[0])
+    database.log_values([CoinValue(database.get_coin(coin), 1, 1, 1) for coin in COINS[:2]])
+    trade_log = database.start_trade_log(database.get_coin(COINS[0]), database.get_coin(COINS[1]), False)
+    trade_log.set_ordered(1, 2, 3)
+    trade_log.set_complete(4)
+    database.stop_writer()
+
+    assert sent == [
+        ("current_coin_history", 1),
+        ("coin_value", 2),
+        ("coin_value", 2),
+        ("trade_history", 1),
+        ("trade_history", 1),
+        ("trade_history", 1),
+    ]
+
+
+def test_trade_that_could_not_be_written_is_not_updated(database):
+    def fail(*_):
+        raise RuntimeError("Disk full")
+
+    event.listen(Trade, "before_insert", fail)
+    try:
+        trade_log = database.start_trade_log(database.get_coin(COINS[0]), database.get_coin(COINS[1]), False)
+    finally:
+        event.remove(Trade, "before_insert", fail)
+
+    with pytest.raises(RuntimeError):
+        trade_log.set_ordered(1, 2, 3)
+    with database.db_session() as session:
+        assert session.query(Trade).filter(Trade.state == TradeState.ORDERED).count() == 0
+
+
+def test_migrated_ratios_are_cached(database, tmp_path):
+    (tmp_path / ".current_coin_table").write_text('{"AAA": {"AAA": 1, "BBB": 2.5}}')
+    database.migrate_old_state()
+
+    assert database.get_pair("AAA", "BBB").ratio == 2.5
+    with database.db_session() as session:
+        assert session.query(Pair.ratio).filter(Pair.from_coin_id == "AAA", Pair.to_coin_id == "BBB").scalar() == 2.5
+
+
+def test_scout_history_buckets_are_only_known_to_their_database(database, tmp_path):
+    database.log_scout(database.get_pair(COINS[0], COINS[1]), 1, 1, 1)
+    database.flush_scout_history()
+    reader = Database(database.logger, database.config, f"sqlite:///{tmp_path / 'bot.db'}")
+    assert len(reader.get_scout_history(COINS[0])) == 1
+    assert not [name for name in Base.metadata.tables if name.startswith("scout_history_")]
+
+    # The bot drops the tables past the retention time, and the reader forgets them once they're gone
+    database.config.SCOUT_HISTORY_PRUNE_TIME = -1
+    database.prune_scout_history()
+    assert reader.get_scout_history(COINS[0]) == []
+    tables = reader._scout_history_metadata.tables  # pylint: disable=protected-access
+    assert [name for name in tables if name.startswith("scout_history_")] == []
@@ -0,0 +1,37 @@
+import importlib
+
+from binance_trade_bot.backtest import backtest
+from binance_trade_bot.config import Config
+
+from .conftest import COINS, END_DATE, START_DATE
+
+# The package exports the sweep() function under the same name as its module
+sweep_module = importlib.import_module("binance_trade_bot.sweep")
+
+
+def test_sweep_final_value_matches_backtest(price_store, snapshot, monkeypatch):
+    monkeypatch.setattr(sweep_module, "cache", price_store)
+    grid = {"SUPPORTED_COIN_LIST": [COINS], "SCOUT_MULTIPLIER": [1, 5]}
+    results = sweep_module.sweep(grid, START_DATE, END_DATE, yield_interval=97, max_workers=1, snapshot=snapshot)
+
+    assert len(results) == 2
+    for result in results:
+        manager = None
+        for manager in backtest(
+            START_DATE,
+            END_DATE,
+            yield_interval=97,
+            config=Config(SUPPORTED_COIN_LIST=COINS, SCOUT_MULTIPLIER=result["SCOUT_MULTIPLIER"]),
+            store=price_store,
+            snapshot=snapshot,
+        ):
+            pass
+        # The backtest ends after the last minute it scouted, which is the one its balances are valued at
+        manager.increment(-1)
+
+        assert result["balances"] == manager.balances
+        assert result["btc_value"] == manager.collate_coins("BTC")
+        assert result["bridge_value"] == manager.collate_coins("USDT")
+        # The whole portfolio is valued, not only what is left of the bridge coin
+        assert result["bridge_value"] > 50
+        assert result["times"][-1] < END_DATE